@@ -0,0 +1,238 @@
+"""
+Compact storage for the aggregate reports, which count how often each
+extracted item (style, include, class) appears on each page.
+
+Rather than a list of [slug, count] lists per item, slugs are interned to
+integer IDs, every occurrence is recorded in flat arrays, and these are then
+grouped into a single array of (slug ID, count) entries shared by all items.
+The report and posting list adapters expand this back into the
+(item, pages, count) and (slug, count) tuples the templates iterate over,
+only as they are read.
+"""
+
+from array import array
+
+# Unsigned, at least 32 bits
+ARRAY_TYPECODE = "I"
+
+
+def zeroed_array(length):
+    return array(ARRAY_TYPECODE, bytes(length * array(ARRAY_TYPECODE).itemsize))
+
+
+class SlugTable:
+    """
+    Interns page slugs, so each one is stored once
+    and the aggregates refer to it by an integer ID.
+    """
+
+    __slots__ = ("slugs", "ids")
+
+    def __init__(self):
+        self.slugs = []
+        self.ids = {}
+
+    def intern(self, slug):
+        slug_id = self.ids.get(slug)
+        if slug_id is None:
+            slug_id = len(self.slugs)
+            self.slugs.append(slug)
+            self.ids[slug] = slug_id
+
+        return slug_id
+
+
+class PostingList:
+    """
+    The pages one item appears on, with how many times it appears on each,
+    as a slice of alternating slug IDs and counts.
+
+    Iterates as (slug, count) pairs, in the order the pages were first seen.
+    """
+
+    __slots__ = ("slugs", "entries", "start", "stop")
+
+    def __init__(self, slugs, entries, start=0, stop=None):
+        self.slugs = slugs
+        self.entries = entries
+        self.start = start
+        self.stop = len(entries) if stop is None else stop
+
+    def __len__(self):
+        return (self.stop - self.start) // 2
+
+    def __iter__(self):
+        slugs = self.slugs.slugs
+        entries = self.entries
+        for i in range(self.start, self.stop, 2):
+            yield slugs[entries[i]], entries[i + 1]
+
+    def total(self):
+        return sum(self.entries[self.start + 1 : self.stop : 2])
+
+    def sorted_by_count(self):
+        """
+        Returns a copy with the most frequent pages first.
+        Ties are in reverse order, as with sort() then reverse().
+        """
+
+        entries = self.entries
+        start = self.start
+        order = sorted(range(len(self)), key=lambda i: entries[start + 2 * i + 1])
+        order.reverse()
+
+        sorted_entries = array(ARRAY_TYPECODE)
+        for i in order:
+            sorted_entries.append(entries[start + 2 * i])
+            sorted_entries.append(entries[start + 2 * i + 1])
+
+        return PostingList(self.slugs, sorted_entries)
+
+
+class ItemCounts:
+    """
+    Counts the pages each item appears on. Like a dict of multisets,
+    but preserves insertion order, for both items and their pages.
+    Assumes occurrences are added in slug order.
+
+    Occurrences are recorded as two columns of item and slug IDs,
+    which group() then folds into per-item posting lists.
+    """
+
+    __slots__ = (
+        "slugs",
+        "items",
+        "ids",
+        "item_column",
+        "slug_column",
+        "entries",
+        "offsets",
+    )
+
+    def __init__(self, slugs):
+        self.slugs = slugs
+        self.items = []
+        self.ids = {}
+        self.item_column = array(ARRAY_TYPECODE)
+        self.slug_column = array(ARRAY_TYPECODE)
+        self.entries = None
+        self.offsets = None
+
+    def add(self, item, slug_id):
+        item_id = self.ids.get(item)
+        if item_id is None:
+            item_id = len(self.items)
+            self.items.append(item)
+            self.ids[item] = item_id
+
+        self.item_column.append(item_id)
+        self.slug_column.append(slug_id)
+
+    def group(self):
+        """
+        Folds the recorded occurrences into one array of (slug ID, count)
+        entries, where item i has the entries from offsets[i] to offsets[i + 1].
+        """
+
+        item_count = len(self.items)
+        item_column = self.item_column
+        slug_column = self.slug_column
+
+        # Counting sort by item, which keeps each item's occurrences in slug order
+        positions = zeroed_array(item_count + 1)
+        for item_id in item_column:
+            positions[item_id + 1] += 1
+
+        for i in range(item_count):
+            positions[i + 1] += positions[i]
+
+        grouped = zeroed_array(len(slug_column))
+        for item_id, slug_id in zip(item_column, slug_column):
+            grouped[positions[item_id]] = slug_id
+            positions[item_id] += 1
+
+        # Each item's occurrences now end where the next item's start
+        entries = array(ARRAY_TYPECODE)
+        offsets = zeroed_array(item_count + 1)
+        start = 0
+
+        for item_id in range(item_count):
+            stop = positions[item_id]
+            last_slug_id = None
+
+            for i in range(start, stop):
+                slug_id = grouped[i]
+                if slug_id == last_slug_id:
+                    entries[-1] += 1
+                else:
+                    entries.append(slug_id)
+                    entries.append(1)
+                    last_slug_id = slug_id
+
+            offsets[item_id + 1] = len(entries)
+            start = stop
+
+        self.entries = entries
+        self.offsets = offsets
+        self.ids = None
+        self.item_column = None
+        self.slug_column = None
+
+    def get_pages(self, item_id):
+        return PostingList(
+            self.slugs,
+            self.entries,
+            self.offsets[item_id],
+            self.offsets[item_id + 1],
+        )
+
+    def get_page_count(self, item_id):
+        return (self.offsets[item_id + 1] - self.offsets[item_id]) // 2
+
+    def __iter__(self):
+        for item_id, item in enumerate(self.items):
+            yield item, self.get_pages(item_id)
+
+    def by_page_count(self):
+        """
+        Returns the items as a report, with those on the most pages first.
+        Ties are in reverse order, as with sort() then reverse().
+        """
+
+        order = sorted(range(len(self.items)), key=self.get_page_count)
+        order.reverse()
+        return ItemReport(self, array(ARRAY_TYPECODE, order))
+
+
+class ItemReport:
+    """
+    A read-only sequence of (item, pages, count) entries, in the given order,
+    where pages is a PostingList and count is the number of pages.
+    """
+
+    __slots__ = ("counts", "order")
+
+    def __init__(self, counts, order):
+        self.counts = counts
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get_entry(item_id) for item_id in self.order[index]]
+
+        return self.get_entry(self.order[index])
+
+    def __iter__(self):
+        for item_id in self.order:
+            yield self.get_entry(item_id)
+
+    def get_entry(self, item_id):
+        counts = self.counts
+        return (
+            counts.items[item_id],
+            counts.get_pages(item_id),
+            counts.get_page_count(item_id),
+        )
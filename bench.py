@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks the main stages of the pipeline on a synthetic corpus.
+
+Each benchmark is run several times and the fastest run is kept, to reduce noise.
+Results can be saved as a baseline, and later runs compared against it,
+exiting with an error if any benchmark regressed by more than the threshold.
+Baselines are only meaningful on the machine where they were recorded.
+"""
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import json
+from argparse import ArgumentParser
+from collections import namedtuple
+
+import build
+import grep
+from config import Configuration
+from cssindex import update_index
+from fetch import Crawler
+from includegraph import ensure_graph
+from store import PageStore
+from synthetic import CorpusGenerator, generate_corpus
+from themes import update_signatures
+
+DEFAULT_BASELINE_PATH = "bench-baseline.json"
+DEFAULT_THRESHOLD = 0.2
+WRITE_PAGE_LIMIT = 2000
+
+BenchContext = namedtuple(
+    "BenchContext",
+    ("corpus_path", "indexed_path", "directory", "site", "pages", "seed"),
+)
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+class Timer:
+    __slots__ = ("start", "elapsed")
+
+    def __init__(self):
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def fresh_copy(ctx, source_path, name):
+    path = os.path.join(ctx.directory, name)
+    shutil.copyfile(source_path, path)
+    return path
+
+
+def get_edges(ctx, limit=None):
+    count = ctx.pages if limit is None else min(limit, ctx.pages)
+    generator = CorpusGenerator(ctx.seed, [ctx.site])
+    return list(generator.make_edges(count))
+
+
+# Benchmarks
+
+
+@benchmark("process_edge")
+def bench_process_edge(ctx, timer):
+    edges = get_edges(ctx)
+
+    with timer:
+        for edge in edges:
+            Crawler.process_edge(edge)
+
+
+@benchmark("write_page")
+def bench_write_page(ctx, timer):
+    pages = [Crawler.process_edge(edge)[0] for edge in get_edges(ctx, WRITE_PAGE_LIMIT)]
+    path = os.path.join(ctx.directory, "write-page.sqlite")
+    config_path = os.path.join(ctx.directory, "write-page.toml")
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    with open(config_path, "w", encoding="utf-8") as file:
+        file.write(f"output-path = {json.dumps(path)}\nsites = [{json.dumps(ctx.site)}]\n")
+
+    crawler = Crawler(Configuration(config_path))
+
+    with timer:
+        for page in pages:
+            crawler.write_page(page)
+
+    crawler.close()
+
+
+@benchmark("update_indexes")
+def bench_update_indexes(ctx, timer):
+    store = PageStore(fresh_copy(ctx, ctx.corpus_path, "update-indexes.sqlite"))
+
+    with timer, store.writer() as conn:
+        update_index(conn)
+        update_signatures(conn)
+        ensure_graph(conn)
+
+    store.close()
+
+
+@benchmark("deduplicate_items")
+def bench_deduplicate_items(ctx, timer):
+    store = PageStore(ctx.indexed_path, readonly=True)
+
+    with timer:
+        build.deduplicate_items(store.iter_extracts([ctx.site]), ctx.site)
+
+    store.close()
+
+
+@benchmark("build_site")
+def bench_build_site(ctx, timer):
+    output_directory = os.path.join(ctx.directory, "output")
+    shutil.rmtree(output_directory, ignore_errors=True)
+
+    options = build.BuildOptions(
+        database_path=ctx.indexed_path,
+        cache_path=os.path.join(ctx.directory, "cache"),
+        output_directory=output_directory,
+        base_path=build.BASE_PATH,
+        theme_similarity=0.8,
+        profile=False,
+        cprofile_path=None,
+        slugs=None,
+    )
+
+    with timer:
+        build.build_site(ctx.site, options)
+
+
+@benchmark("grep")
+def bench_grep(ctx, timer):
+    regex = re.compile(r"module\s+css", re.MULTILINE | re.IGNORECASE)
+    options = grep.RegexOptions(invert=False, flags=regex.flags, sites=None)
+    store = PageStore(ctx.corpus_path, readonly=True)
+
+    with timer:
+        grep.grep(store, regex, options)
+
+    store.close()
+
+
+# Running and reporting
+
+
+def run_benchmarks(ctx, names, repeat):
+    results = {}
+
+    for name in names:
+        timings = []
+        for _ in range(repeat):
+            timer = Timer()
+            BENCHMARKS[name](ctx, timer)
+            timings.append(timer.elapsed)
+
+        results[name] = min(timings)
+        print(f"  {name:<24} {results[name]:>9.3f}s", file=sys.stderr)
+
+    return results
+
+
+def compare_results(results, baseline, threshold):
+    """
+    Prints a comparison against the baseline,
+    and returns the names of the benchmarks which regressed.
+    """
+
+    regressions = []
+
+    print(f"{'Benchmark':<24} {'Time':>10} {'Baseline':>10} {'Change':>8}")
+    for name, seconds in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<24} {seconds:>9.3f}s {'-':>10} {'-':>8}")
+            continue
+
+        change = seconds / previous - 1
+        marker = ""
+        if change > threshold:
+            regressions.append(name)
+            marker = "  REGRESSION"
+
+        print(f"{name:<24} {seconds:>9.3f}s {previous:>9.3f}s {change:>+8.1%}{marker}")
+
+    return regressions
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description="Benchmark the pipeline on a synthetic corpus")
+    argparser.add_argument(
+        "-n",
+        "--pages",
+        type=int,
+        default=1000,
+        help="How many pages the synthetic corpus should have",
+    )
+    argparser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The random seed for the synthetic corpus",
+    )
+    argparser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="How many times to run each benchmark (the fastest run is kept)",
+    )
+    argparser.add_argument(
+        "--only",
+        default=None,
+        help=f"Only run these benchmarks (comma-separated, from: {', '.join(BENCHMARKS)})",
+    )
+    argparser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE_PATH,
+        help="The baseline file to compare against",
+    )
+    argparser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        default=False,
+        dest="save_baseline",
+        help="Save these results as the new baseline",
+    )
+    argparser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="How much slower than the baseline counts as a regression (0.2 is 20%%)",
+    )
+    args = argparser.parse_args()
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            argparser.error(f"Unknown benchmark: {name}")
+
+    # build.py loads templates relative to the repository
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    with tempfile.TemporaryDirectory(prefix="wikidot-bench-") as directory:
+        site = "scp-wiki"
+        corpus_path = os.path.join(directory, "corpus.sqlite")
+        indexed_path = os.path.join(directory, "indexed.sqlite")
+
+        print(f"Generating {args.pages} page corpus...", file=sys.stderr)
+        generate_corpus(corpus_path, args.pages, args.seed, [site])
+        shutil.copyfile(corpus_path, indexed_path)
+
+        store = PageStore(indexed_path)
+        with store.writer() as conn:
+            update_index(conn)
+            update_signatures(conn)
+            ensure_graph(conn)
+
+        store.close()
+
+        ctx = BenchContext(
+            corpus_path=corpus_path,
+            indexed_path=indexed_path,
+            directory=directory,
+            site=site,
+            pages=args.pages,
+            seed=args.seed,
+        )
+
+        # The build code prints its progress, which would drown out the results
+        print("Running benchmarks...", file=sys.stderr)
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            results = run_benchmarks(ctx, names, args.repeat)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    baseline = load_baseline(args.baseline)
+    regressions = []
+
+    if baseline is None:
+        compare_results(results, {}, args.threshold)
+    elif (baseline["pages"], baseline["seed"]) != (args.pages, args.seed):
+        print(
+            f"Baseline was recorded with {baseline['pages']} pages (seed {baseline['seed']}), "
+            "not comparing",
+            file=sys.stderr,
+        )
+        compare_results(results, {}, args.threshold)
+    else:
+        regressions = compare_results(results, baseline["results"], args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(
+                {"pages": args.pages, "seed": args.seed, "results": results},
+                file,
+                indent=2,
+            )
+
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+
+    if regressions:
+        print(f"Regressed beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
@@ -1,26 +1,61 @@
 #!/usr/bin/env python3
 
-import hashlib
+import json
 import os
-import re
-import sqlite3
-from contextlib import ExitStack
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict, namedtuple
 from datetime import datetime
+from functools import partial
 
 import jinja2
 
-from config import Configuration
+from aggregates import ItemCounts, SlugTable
+from config import DEFAULT_CONFIG_PATH, Configuration
+from cssindex import get_property_usage, get_selector_usage, update_index
+from helpers import parse_include, sha1_hex
+from includegraph import ensure_graph, get_impact_counts, get_include_key
+from profiling import BuildProfiler, print_report, write_report
+from searchindex import write_search_index
+from store import PageStore
+from themes import find_theme_families, update_signatures
 
 CountedItems = namedtuple(
     "CountedItems",
     ("module_styles", "inline_styles", "classes", "includes", "site_includes"),
 )
 
-DEFAULT_SITE = None
+CssUsage = namedtuple("CssUsage", ("properties", "selectors"))
+
+BuildOptions = namedtuple(
+    "BuildOptions",
+    (
+        "database_path",
+        "cache_path",
+        "output_directory",
+        "base_path",
+        "theme_similarity",
+        "profile",
+        "cprofile_path",
+        "slugs",
+    ),
+)
+
+SiteSummary = namedtuple(
+    "SiteSummary",
+    (
+        "site",
+        "base_path",
+        "page_count",
+        "module_styles",
+        "inline_styles",
+        "includes",
+        "classes",
+    ),
+)
 
-INCLUDE_REGEX = re.compile(r"^(?::([a-z0-9\-]+):)?([a-z0-9\-:_]+)$", re.IGNORECASE)
-SCP_SLUG_REGEX = re.compile(r"^scp-([0-9]+)(.*)$", re.IGNORECASE)
+BASE_PATH = "/wikidot-css-extractor"
+SUMMARY_FILENAME = "summary.json"
 
 COMPARISON_FUNCTIONS = {
     ">": lambda x, y: x > y,
@@ -32,87 +67,86 @@ COMPARISON_FUNCTIONS = {
 }
 
 
-def get_page_url(slug):
-    return f"https://{DEFAULT_SITE}.wikidot.com/{slug}"
+def get_page_url(current_site, slug):
+    return f"https://{current_site}.wikidot.com/{slug}"
 
 
-def get_include_url(include):
-    match = INCLUDE_REGEX.match(include)
-    if match is None:
+def get_include_url(current_site, include):
+    parts = parse_include(include)
+    if parts is None:
         return None
 
-    site, page = match.groups()
+    site, page = parts
     if site is None:
-        site = DEFAULT_SITE
+        site = current_site
 
     return f"https://{site}.wikidot.com/{page}"
 
 
-def get_local_include_slug(include):
-    match = INCLUDE_REGEX.match(include)
-    if match is None:
-        return None
-
-    site, page = match.groups()
-    if site != DEFAULT_SITE:
-        return None
-
-    return page
-
-
-def get_extracts(page, extract_type):
-    return (
-        row["source"]
-        for row in cur.execute(
-            """
-        SELECT source FROM extracts
-        WHERE page_url = ?
-        AND extract_type = ?
-        ORDER BY extract_index
-        """,
-            (page["url"], extract_type),
-        )
-    )
-
-
-class MultiList(list):
+def get_local_include_slug(current_site, include):
     """
-    Like a multiset, but preserves insertion order.
-    Assumes input data is sorted.
-
-    Internally, a list where each element is [item, count].
+    Returns the slug of the included page if it is on the current site,
+    either explicitly or because the include has no site prefix.
     """
 
-    def append(self, item):
-        if self and self[-1][0] == item:
-            self[-1][1] += 1
-        else:
-            super().append([item, 1])
+    parts = parse_include(include)
+    if parts is None:
+        return None
 
-    def extend(self, items):
-        for item in items:
-            self.append(item)
+    site, page = parts
+    if site is not None and site != current_site:
+        return None
 
+    return page
 
-def build_html(cur, counts):
-    # Get page count
-    (page_count,) = cur.execute("SELECT COUNT(*) FROM pages").fetchone()
 
-    # Build jinja environment and helpers
+def build_environment(cache_path, profiler):
+    # The bytecode cache stores a checksum of each template's source,
+    # so editing a template causes it to be recompiled automatically.
+    os.makedirs(cache_path, exist_ok=True)
     env = jinja2.Environment(
         loader=jinja2.FileSystemLoader("templates"),
+        bytecode_cache=jinja2.FileSystemBytecodeCache(cache_path),
         autoescape=True,
     )
     env.globals["cmp"] = lambda x, operator, y: COMPARISON_FUNCTIONS[operator](x, y)
-    env.globals["get_page_url"] = get_page_url
-    env.globals["get_include_url"] = get_include_url
-    env.globals["get_local_include_slug"] = get_local_include_slug
-    env.globals["page_key"] = page_slug_key
+    env.globals["base_path"] = BASE_PATH
     env.globals["now"] = datetime.utcnow
-    env.globals["page_count"] = page_count
     env.filters["commaify"] = lambda number: format(number, ",d")
     env.filters["reverse"] = reversed
-    env.filters["sha1"] = lambda data: hashlib.sha1(data.encode("utf-8")).hexdigest()
+    env.filters["sha1"] = profiler.wrap("sha1", sha1_hex)
+    return env
+
+
+def build_html(
+    store,
+    site,
+    page_count,
+    counts,
+    css_usage,
+    theme_families,
+    impact_counts,
+    profiler,
+    options,
+):
+    # Build jinja environment and helpers
+    env = build_environment(options.cache_path, profiler)
+    env.globals["site"] = site
+    env.globals["base_path"] = options.base_path
+    env.globals["get_page_url"] = partial(get_page_url, site)
+    env.globals["get_include_url"] = profiler.wrap(
+        "get_include_url",
+        partial(get_include_url, site),
+    )
+    env.globals["get_local_include_slug"] = profiler.wrap(
+        "get_local_include_slug",
+        partial(get_local_include_slug, site),
+    )
+    env.globals["get_include_impact"] = lambda include: impact_counts.get(
+        get_include_key(site, include),
+        0,
+    )
+    env.globals["page_count"] = page_count
 
     # Get templates
     page_template = env.get_template("page.j2")
@@ -120,114 +154,149 @@ def build_html(cur, counts):
     inline_styles_template = env.get_template("inline-css.j2")
     includes_template = env.get_template("includes.j2")
     classes_template = env.get_template("classes.j2")
+    properties_template = env.get_template("properties.j2")
+    selectors_template = env.get_template("selectors.j2")
+    themes_template = env.get_template("themes.j2")
     page_index_template = env.get_template("page-index.j2")
     index_template = env.get_template("index.j2")
 
     # Build HTML
     html_pages = {}
-    pages = cur.execute("SELECT * FROM pages ORDER BY slug")
+    pages = profiler.wrap_iter(
+        "iter_pages_with_extracts",
+        store.iter_pages_with_extracts(
+            [site],
+            columns=("url", "slug", "title", "source"),
+            slugs=options.slugs,
+        ),
+    )
 
-    print(f"Generating {page_count} individual pages...")
-    for page in pages:
-        slug = page["slug"]
+    if options.slugs is None:
+        print(f"Generating {page_count} individual pages...")
+    else:
+        print(f"Generating {len(options.slugs)} changed individual pages...")
 
-        html_pages[f"pages/{slug}"] = page_template.render(
+    for page, extracts in pages:
+        slug = page["slug"]
+        name = f"pages/{slug}"
+        html_pages[name] = profiler.render(
+            page_template,
+            name,
             slug=slug,
             title=page["title"],
             source=page["source"],
-            module_styles=list(get_extracts(page, "module_style")),
-            inline_styles=list(get_extracts(page, "inline_style")),
-            includes=list(get_extracts(page, "include")),
-            classes=list(get_extracts(page, "class")),
+            module_styles=extracts["module_style"],
+            inline_styles=extracts["inline_style"],
+            includes=extracts["include"],
+            classes=extracts["class"],
         )
 
     print("Generating detail pages...")
-    html_pages["module-css"] = module_styles_template.render(
+    html_pages["module-css"] = profiler.render(
+        module_styles_template,
+        "module-css",
         styles=counts.module_styles,
     )
-    html_pages["inline-css"] = inline_styles_template.render(
+    html_pages["inline-css"] = profiler.render(
+        inline_styles_template,
+        "inline-css",
         styles=counts.inline_styles,
     )
-    html_pages["includes"] = includes_template.render(
+    html_pages["includes"] = profiler.render(
+        includes_template,
+        "includes",
         includes=counts.includes,
         site_includes=counts.site_includes,
     )
-    html_pages["classes"] = classes_template.render(classes=counts.classes)
-    html_pages["pages/index"] = page_index_template.render(pages=pages)
+    html_pages["classes"] = profiler.render(
+        classes_template,
+        "classes",
+        classes=counts.classes,
+    )
+    html_pages["properties"] = profiler.render(
+        properties_template,
+        "properties",
+        properties=css_usage.properties,
+    )
+    html_pages["selectors"] = profiler.render(
+        selectors_template,
+        "selectors",
+        selectors=css_usage.selectors,
+    )
+    html_pages["themes"] = profiler.render(
+        themes_template,
+        "themes",
+        families=theme_families,
+        threshold=options.theme_similarity,
+    )
+    html_pages["pages/index"] = profiler.render(
+        page_index_template,
+        "pages/index",
+    )
 
     print("Generating index...")
-    html_pages["index"] = index_template.render(
-        pages=pages,
+    html_pages["index"] = profiler.render(
+        index_template,
+        "index",
         module_styles=counts.module_styles,
         inline_styles=counts.inline_styles,
         includes=counts.includes,
         site_includes=counts.site_includes,
         classes=counts.classes,
+        properties=css_usage.properties,
+        selectors=css_usage.selectors,
+        theme_families=theme_families,
     )
 
     return html_pages
 
 
-def write_html(html_pages):
-    os.makedirs("output", exist_ok=True)
+def write_html(html_pages, output_directory="output"):
+    os.makedirs(os.path.join(output_directory, "pages"), exist_ok=True)
 
     print("Writing files...")
     for name, html in html_pages.items():
-        with open(f"output/{name}.html", "w", encoding="utf-8") as file:
+        path = os.path.join(output_directory, f"{name}.html")
+        with open(path, "w", encoding="utf-8") as file:
             file.write(html)
 
 
-def page_slug_key(slug):
-    if slug.startswith("adult:"):
-        return page_slug_key(slug[6:])
-
-    match = SCP_SLUG_REGEX.match(slug)
-    if match is None:
-        return slug
-    else:
-        number = int(match[1])
-        suffix = match[2]
-        return f"scp-{number:07}{suffix}"
-
-
-def deduplicate_items(cur):
-    print("Processing data...")
-
-    module_styles_count = defaultdict(MultiList)
-    inline_styles_count = defaultdict(MultiList)
-    classes_count = defaultdict(MultiList)
-    includes_count = defaultdict(MultiList)
-
-    pages = cur.execute("SELECT * FROM pages ORDER BY slug")
-    for page in pages:
-        slug = page["slug"]
+def deduplicate_items(extracts, current_site):
+    """
+    Counts the pages using each extract, from the rows of
+    PageStore.iter_extracts() for the site.
+    """
 
-        for style in get_extracts(page, "module_style"):
-            module_styles_count[style].append(slug)
+    print(f"Processing data for {current_site}...")
 
-        for style in get_extracts(page, "inline_style"):
-            inline_styles_count[style].append(slug)
+    slugs = SlugTable()
+    module_styles_count = ItemCounts(slugs)
+    inline_styles_count = ItemCounts(slugs)
+    classes_count = ItemCounts(slugs)
+    includes_count = ItemCounts(slugs)
 
-        for include in get_extracts(page, "include"):
-            includes_count[include].append(slug)
+    extract_counts = {
+        "module_style": module_styles_count,
+        "inline_style": inline_styles_count,
+        "include": includes_count,
+        "class": classes_count,
+    }
 
-        for klass in get_extracts(page, "class"):
-            classes_count[klass].append(slug)
+    # Extracts come in slug order, as ItemCounts expects
+    for slug, _, extract_type, source in extracts:
+        extract_counts[extract_type].add(source, slugs.intern(slug))
 
-    def convert(counts):
-        items = [(item, pages, len(pages)) for item, pages in counts.items()]
-        items.sort(key=lambda item: item[2])
-        items.reverse()
-        return items
+    for counts in extract_counts.values():
+        counts.group()
 
-    # This is more complicated than convert(),
+    # This is more complicated than the other reports,
     # since we need to fold both by sites and then pages within them.
     #
     # This uses an imperative loop rather than functional mappings
     # because they were getting really messy and hard to understand.
 
     def convert_site_includes():
-        site_includes_count = includes_by_site(includes_count)
+        site_includes_count = includes_by_site(current_site, includes_count)
         entries = []
 
         for site, includes in site_includes_count.items():
@@ -235,18 +304,9 @@ def deduplicate_items(cur):
             site_count = 0
 
             for include, pages in includes.items():
-                include_entries = []
-                include_count = 0
-
-                for slug, count in pages:
-                    include_count += count
-                    include_entries.append((slug, count))
-
-                include_entries.sort(key=lambda item: item[1])
-                include_entries.reverse()
-
+                include_count = pages.total()
                 site_count += include_count
-                site_entries.append((include, include_entries, include_count))
+                site_entries.append((include, pages.sorted_by_count(), include_count))
 
             site_entries.sort(key=lambda item: item[2])
             site_entries.reverse()
@@ -257,11 +317,11 @@ def deduplicate_items(cur):
         entries.reverse()
         return entries
 
-    module_styles = convert(module_styles_count)
-    inline_styles = convert(inline_styles_count)
-    includes = convert(includes_count)
+    module_styles = module_styles_count.by_page_count()
+    inline_styles = inline_styles_count.by_page_count()
+    includes = includes_count.by_page_count()
     site_includes = convert_site_includes()
-    classes = convert(classes_count)
+    classes = classes_count.by_page_count()
 
     return CountedItems(
         module_styles=module_styles,
@@ -272,35 +332,305 @@ def deduplicate_items(cur):
     )
 
 
-def includes_by_site(includes_count):
-    site_includes_count = defaultdict(lambda: defaultdict(list))
+def includes_by_site(current_site, includes_count):
+    site_includes_count = defaultdict(dict)
 
-    for include, slugs in includes_count.items():
-        match = INCLUDE_REGEX.match(include)
-        if match is None:
+    for include, pages in includes_count:
+        parts = parse_include(include)
+        if parts is None:
             continue
 
-        site, page = match.groups()
+        site, page = parts
         if site is None:
-            site = DEFAULT_SITE
+            site = current_site
 
-        site_includes_count[site][include].extend(slugs)
+        site_includes_count[site][include] = pages
 
     return site_includes_count
 
 
-def set_current_site(config):
-    global DEFAULT_SITE
+def build_site(site, options):
+    """
+    Builds the complete report for one site.
+
+    This runs in a worker process, so it opens its own (read-only) store.
+    Returns the site summary and the profiling report (if enabled).
+    """
+
+    if options.cprofile_path is None:
+        cprofile_path = None
+    else:
+        root, ext = os.path.splitext(options.cprofile_path)
+        cprofile_path = f"{root}-{site}{ext}"
+
+    profiler = BuildProfiler(enabled=options.profile, cprofile_path=cprofile_path)
+    profiler.start()
+
+    store = PageStore(options.database_path, readonly=True)
+    with store.reader() as cur:
+        page_count = store.get_page_count(site)
+
+        with profiler.phase("deduplicate_items"):
+            extracts = profiler.wrap_iter("iter_extracts", store.iter_extracts([site]))
+            counts = deduplicate_items(extracts, site)
+
+        with profiler.phase("css_usage"):
+            css_usage = CssUsage(
+                properties=get_property_usage(cur, site),
+                selectors=get_selector_usage(cur, site),
+            )
+
+        with profiler.phase("theme_families"):
+            theme_families = find_theme_families(
+                cur,
+                counts.module_styles,
+                options.theme_similarity,
+            )
+
+        with profiler.phase("search_index"):
+            write_search_index(cur, site, options.output_directory)
+
+        with profiler.phase("include_impact"):
+            impact_counts = get_impact_counts(cur)
+
+        with profiler.phase("build_html"):
+            generated_html = build_html(
+                store,
+                site,
+                page_count,
+                counts,
+                css_usage,
+                theme_families,
+                impact_counts,
+                profiler,
+                options,
+            )
+
+    store.close()
+
+    with profiler.phase("write_html"):
+        write_html(generated_html, options.output_directory)
+
+    profiler.stop()
+
+    summary = SiteSummary(
+        site=site,
+        base_path=options.base_path,
+        page_count=page_count,
+        module_styles=len(counts.module_styles),
+        inline_styles=len(counts.inline_styles),
+        includes=len(counts.includes),
+        classes=len(counts.classes),
+    )
+    write_site_summary(summary, options.output_directory)
+
+    return profiler.report() if profiler.enabled else None
+
+
+def write_site_summary(summary, output_directory):
+    path = os.path.join(output_directory, SUMMARY_FILENAME)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(summary._asdict(), file)
+
 
-    DEFAULT_SITE = config.default_site
+def load_site_summary(output_directory):
+    path = os.path.join(output_directory, SUMMARY_FILENAME)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding="utf-8") as file:
+        return SiteSummary(**json.load(file))
+
+
+def build_overview(summaries, cache_path):
+    print("Generating overview...")
+    env = build_environment(cache_path, BuildProfiler())
+    template = env.get_template("overview.j2")
+    summaries = sorted(summaries, key=lambda summary: summary.page_count)
+    summaries.reverse()
+    return {"index": template.render(sites=summaries)}
+
+
+def get_build_options(
+    config,
+    site,
+    multi_site,
+    profile=False,
+    cprofile_path=None,
+    slugs=None,
+):
+    if multi_site:
+        output_directory = os.path.join("output", site)
+        base_path = f"{BASE_PATH}/{site}"
+    else:
+        output_directory = "output"
+        base_path = BASE_PATH
+
+    return BuildOptions(
+        database_path=config.output_path,
+        cache_path=config.cache_path,
+        output_directory=output_directory,
+        base_path=base_path,
+        theme_similarity=config.theme_similarity,
+        profile=profile,
+        cprofile_path=cprofile_path,
+        slugs=slugs,
+    )
+
+
+def build_sites(
+    config,
+    sites,
+    jobs=1,
+    overview=True,
+    profile=False,
+    cprofile_path=None,
+    changed_slugs=None,
+    update_indexes=True,
+):
+    """
+    Builds the reports for the given sites, and the overview for multi-site
+    configurations. Returns the profiling reports, by site.
+
+    If changed_slugs is given, it maps each site to the slugs of its pages
+    which changed. Only those individual pages are rendered again,
+    though every aggregate page still is. Sites which map to None,
+    or which haven't been built before, are built in full.
+
+    Pass update_indexes=False if the pages were written with their indexes
+    (as fetch.py does), to skip rescanning every extract in the database.
+    """
+
+    multi_site = len(config.sites) > 1
+
+    # Done once up front, since site builds only read from the database
+    store = PageStore(config.output_path)
+    if update_indexes:
+        print("Updating indexes...")
+        with store.writer() as conn:
+            update_index(conn)
+            update_signatures(conn)
+            ensure_graph(conn)
+
+    store.close()
+
+    jobs = max(1, min(jobs or 1, len(sites)))
+    build_jobs = []
+
+    for site in sites:
+        options = get_build_options(
+            config,
+            site,
+            multi_site,
+            profile=profile,
+            cprofile_path=cprofile_path,
+        )
+
+        if changed_slugs is not None and changed_slugs.get(site) is not None:
+            if load_site_summary(options.output_directory) is not None:
+                options = options._replace(slugs=changed_slugs[site])
+
+        build_jobs.append((site, options))
+
+    if jobs == 1:
+        reports = [build_site(site, options) for site, options in build_jobs]
+    else:
+        print(f"Building {len(sites)} sites with {jobs} workers...")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(build_site, site, options)
+                for site, options in build_jobs
+            ]
+            reports = [future.result() for future in futures]
+
+    if multi_site and overview:
+        # Read back every site's summary, so the overview stays complete
+        # even if only some of the sites were rebuilt this time.
+        summaries = []
+        for site in config.sites:
+            options = get_build_options(config, site, multi_site)
+            summary = load_site_summary(options.output_directory)
+            if summary is not None:
+                summaries.append(summary)
+
+        write_html(build_overview(summaries, config.cache_path))
+
+    return dict(zip(sites, reports))
 
 
 if __name__ == "__main__":
-    config = Configuration()
-    set_current_site(config)
-    conn = sqlite3.connect(config.output_path)
-    conn.row_factory = sqlite3.Row
-    with conn as cur:
-        counts = deduplicate_items(cur)
-        generated_html = build_html(cur, counts)
-    write_html(generated_html)
+    argparser = ArgumentParser(description="Build the HTML report")
+    argparser.add_argument(
+        "-s",
+        "--site",
+        action="append",
+        default=None,
+        dest="sites",
+        help="Only build the report for this site (may be repeated)",
+    )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="How many sites to build in parallel",
+    )
+    argparser.add_argument(
+        "--no-overview",
+        action="store_false",
+        default=True,
+        dest="overview",
+        help="Don't generate the combined overview page for multi-site builds",
+    )
+    argparser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help="Record time and peak memory for each build phase and template",
+    )
+    argparser.add_argument(
+        "--profile-json",
+        default=None,
+        dest="profile_json",
+        help="Write the profiling report as JSON to this path (implies --profile)",
+    )
+    argparser.add_argument(
+        "--cprofile",
+        default=None,
+        dest="cprofile_path",
+        help="Write cProfile statistics to this path, suffixed by site (implies --profile)",
+    )
+    argparser.add_argument(
+        "config",
+        nargs="?",
+        default=DEFAULT_CONFIG_PATH,
+        help=f"The configuration file to use (default {DEFAULT_CONFIG_PATH})",
+    )
+    args = argparser.parse_args()
+
+    config = Configuration(args.config)
+    sites = args.sites or config.sites
+
+    for site in sites:
+        if site not in config.sites:
+            argparser.error(f"Site not in configuration: {site}")
+
+    reports = build_sites(
+        config,
+        sites,
+        jobs=args.jobs,
+        overview=args.overview,
+        profile=(
+            args.profile
+            or args.profile_json is not None
+            or args.cprofile_path is not None
+        ),
+        cprofile_path=args.cprofile_path,
+    )
+
+    if any(reports.values()):
+        for site, report in reports.items():
+            print_report(report, title=f"Build profile ({site})")
+
+        if args.profile_json is not None:
+            write_report(reports, args.profile_json)
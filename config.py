@@ -1,5 +1,4 @@
 import os
-import sys
 from functools import cached_property
 
 import tomllib
@@ -8,12 +7,7 @@ DEFAULT_CONFIG_PATH = "config.toml"
 
 
 class Configuration:
-    def __init__(self):
-        if len(sys.argv) >= 2:
-            path = sys.argv[1]
-        else:
-            path = DEFAULT_CONFIG_PATH
-
+    def __init__(self, path=DEFAULT_CONFIG_PATH):
         with open(path, "rb") as file:
             self.data = tomllib.load(file)
 
@@ -26,6 +20,30 @@ class Configuration:
         else:
             return os.path.join("output", path)
 
+    @cached_property
+    def cache_path(self):
+        path = self.data.get("cache-path", "cache")
+        if os.path.isabs(path):
+            return path
+        else:
+            return os.path.join("output", path)
+
+    @cached_property
+    def theme_similarity(self):
+        return float(self.data.get("theme-similarity", 0.8))
+
+    @cached_property
+    def sync_interval(self):
+        return float(self.data.get("sync-interval", 600))
+
+    @cached_property
+    def resync_interval(self):
+        return float(self.data.get("resync-interval", 86400))
+
+    def get_sync_interval(self, site):
+        intervals = self.data.get("sync-intervals", {})
+        return float(intervals.get(site, self.sync_interval))
+
     @cached_property
     def save_page_offset(self):
         return int(self.data["save-page-offset"])
@@ -34,6 +52,10 @@ class Configuration:
     def default_site(self):
         return self.data["sites"][0]
 
+    @property
+    def sites(self):
+        return self.data["sites"]
+
     @cached_property
     def crom_base_urls(self):
         return [f"http://{site}.wikidot.com/" for site in self.data["sites"]]
@@ -0,0 +1,462 @@
+"""
+Property-level index over the CSS found in module and inline style extracts.
+
+Each unique extract is parsed once into (selector, property, value) triples,
+which are stored alongside the crawl results. Postings map every style extract
+back to its unique source, so lookups like "which pages use position: fixed"
+are index queries rather than a regex scan over all the extracts.
+"""
+
+import hashlib
+import re
+from collections import namedtuple
+from itertools import groupby
+from operator import itemgetter
+
+from helpers import get_site_filter, get_site_filter_params
+
+CSS_EXTRACT_TYPES = ("module_style", "inline_style")
+
+REGEX_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+REGEX_CSS_PROPERTY = re.compile(r"^(?:--[\w\-]+|-?[a-z][a-z0-9\-]*)$", re.IGNORECASE)
+REGEX_WHITESPACE = re.compile(r"\s+")
+
+CSS_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS css_sources (
+    source_id INTEGER PRIMARY KEY,
+    source_hash TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS css_declarations (
+    source_id INTEGER NOT NULL,
+    selector TEXT,
+    property TEXT NOT NULL COLLATE NOCASE,
+    value TEXT NOT NULL COLLATE NOCASE
+);
+
+CREATE INDEX IF NOT EXISTS css_declarations_property
+ON css_declarations (property, value);
+
+CREATE INDEX IF NOT EXISTS css_declarations_value
+ON css_declarations (value);
+
+CREATE INDEX IF NOT EXISTS css_declarations_selector
+ON css_declarations (selector);
+
+CREATE INDEX IF NOT EXISTS css_declarations_source
+ON css_declarations (source_id);
+
+CREATE TABLE IF NOT EXISTS css_postings (
+    page_url TEXT NOT NULL,
+    extract_type TEXT NOT NULL,
+    extract_index INTEGER NOT NULL,
+    source_id INTEGER NOT NULL,
+
+    PRIMARY KEY (page_url, extract_type, extract_index)
+);
+
+CREATE INDEX IF NOT EXISTS css_postings_source
+ON css_postings (source_id);
+"""
+
+Declaration = namedtuple("Declaration", ("selector", "property", "value"))
+
+
+# Parsing
+
+
+def split_outside_brackets(text, separator):
+    """
+    Splits on the separator character, except within quotes or parentheses.
+    For instance, the ';' in url("data:image/png;base64,...") is not a split point.
+    """
+
+    parts = []
+    start = 0
+    depth = 0
+    quote = None
+
+    for i, char in enumerate(text):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(depth - 1, 0)
+        elif char == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+
+    parts.append(text[start:])
+    return parts
+
+
+def normalize(text):
+    return REGEX_WHITESPACE.sub(" ", text).strip()
+
+
+def parse_declarations(text, selector=None):
+    declarations = []
+
+    for declaration in split_outside_brackets(text, ";"):
+        property, colon, value = declaration.partition(":")
+        property = property.strip()
+        value = normalize(value)
+
+        if not colon or not value or not REGEX_CSS_PROPERTY.match(property):
+            continue
+
+        declarations.append(Declaration(selector, property.lower(), value))
+
+    return declarations
+
+
+def parse_stylesheet(source):
+    """
+    Parses a stylesheet into a list of declarations.
+
+    Declarations inside nested rules (such as within @media blocks)
+    are attributed to the innermost selector. Declarations directly inside
+    an at-rule (such as @font-face) use the at-rule itself as their selector.
+    """
+
+    source = REGEX_CSS_COMMENT.sub("", source)
+    declarations = []
+    stack = []
+    start = 0
+    depth = 0
+    quote = None
+
+    def add_declarations(text):
+        if not stack:
+            return
+
+        selectors = stack[-1]
+        for selector in selectors:
+            declarations.extend(parse_declarations(text, selector))
+
+    for i, char in enumerate(source):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(depth - 1, 0)
+        elif depth > 0:
+            continue
+        elif char == "{":
+            # Anything before the last ';' belongs to the enclosing block,
+            # which happens with nested rules after some declarations.
+            text = source[start:i]
+            head, _, prelude = text.rpartition(";")
+            add_declarations(head)
+
+            prelude = normalize(prelude)
+            if prelude.startswith("@"):
+                selectors = [prelude]
+            else:
+                selectors = [
+                    normalize(selector)
+                    for selector in split_outside_brackets(prelude, ",")
+                ]
+                selectors = list(filter(None, selectors))
+
+            stack.append(selectors)
+            start = i + 1
+        elif char == "}":
+            add_declarations(source[start:i])
+            if stack:
+                stack.pop()
+
+            start = i + 1
+
+    return declarations
+
+
+def parse_extract(extract_type, source):
+    if extract_type == "inline_style":
+        return parse_declarations(source)
+    else:
+        return parse_stylesheet(source)
+
+
+def get_source_hash(extract_type, source):
+    data = f"{extract_type}\0{source}".encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+# Storage
+
+
+def get_source_id(cur, extract_type, source):
+    """
+    Returns the ID of this unique extract, parsing and storing it
+    if it has not been seen before.
+    """
+
+    source_hash = get_source_hash(extract_type, source)
+    result = cur.execute(
+        "SELECT source_id FROM css_sources WHERE source_hash = ?",
+        (source_hash,),
+    ).fetchone()
+
+    if result is not None:
+        return result[0]
+
+    source_id = cur.execute(
+        "INSERT INTO css_sources (source_hash) VALUES (?)",
+        (source_hash,),
+    ).lastrowid
+
+    cur.executemany(
+        """
+        INSERT INTO css_declarations
+        (source_id, selector, property, value)
+        VALUES
+        (?, ?, ?, ?)
+        """,
+        (
+            (source_id, selector, property, value)
+            for selector, property, value in parse_extract(extract_type, source)
+        ),
+    )
+
+    return source_id
+
+
+def index_page(cur, page_url, extracts):
+    """
+    Replaces the postings for a page.
+
+    The extracts argument maps the extract type to the list of extracts,
+    for instance {"module_style": [...], "inline_style": [...]}.
+    """
+
+    cur.execute("DELETE FROM css_postings WHERE page_url = ?", (page_url,))
+
+    for extract_type in CSS_EXTRACT_TYPES:
+        for index, source in enumerate(extracts.get(extract_type, ())):
+            source_id = get_source_id(cur, extract_type, source)
+            cur.execute(
+                """
+                INSERT INTO css_postings
+                (page_url, extract_type, extract_index, source_id)
+                VALUES
+                (?, ?, ?, ?)
+                """,
+                (page_url, extract_type, index, source_id),
+            )
+
+
+def remove_orphans(cur):
+    cur.execute(
+        """
+        DELETE FROM css_postings
+        WHERE NOT EXISTS (
+            SELECT 1 FROM extracts
+            WHERE extracts.page_url = css_postings.page_url
+            AND extracts.extract_type = css_postings.extract_type
+            AND extracts.extract_index = css_postings.extract_index
+        )
+        """
+    )
+    cur.execute(
+        """
+        DELETE FROM css_sources
+        WHERE NOT EXISTS (
+            SELECT 1 FROM css_postings
+            WHERE css_postings.source_id = css_sources.source_id
+        )
+        """
+    )
+    cur.execute(
+        """
+        DELETE FROM css_declarations
+        WHERE source_id NOT IN (SELECT source_id FROM css_sources)
+        """
+    )
+
+
+def update_index(conn):
+    """
+    Brings the index up to date with the extracts table.
+
+    Every style extract is hashed and compared against its current posting,
+    but only extracts which have never been seen before are parsed.
+    Returns the number of postings which were changed.
+    """
+
+    with conn as cur:
+        rows = cur.execute(
+            """
+            SELECT
+                extracts.page_url,
+                extracts.extract_type,
+                extracts.extract_index,
+                extracts.source,
+                css_sources.source_hash
+            FROM extracts
+            LEFT JOIN css_postings
+                ON css_postings.page_url = extracts.page_url
+                AND css_postings.extract_type = extracts.extract_type
+                AND css_postings.extract_index = extracts.extract_index
+            LEFT JOIN css_sources
+                ON css_sources.source_id = css_postings.source_id
+            WHERE extracts.extract_type IN (?, ?)
+            """,
+            CSS_EXTRACT_TYPES,
+        )
+
+        # Collect changes first, since the postings can't be modified
+        # while the query over them is still being read.
+        changes = [
+            (page_url, extract_type, index, source)
+            for page_url, extract_type, index, source, source_hash in rows
+            if source_hash != get_source_hash(extract_type, source)
+        ]
+
+        for page_url, extract_type, index, source in changes:
+            source_id = get_source_id(cur, extract_type, source)
+            cur.execute(
+                """
+                INSERT INTO css_postings
+                (page_url, extract_type, extract_index, source_id)
+                VALUES
+                (?, ?, ?, ?)
+                ON CONFLICT (page_url, extract_type, extract_index)
+                DO UPDATE
+                SET source_id = ?
+                """,
+                (page_url, extract_type, index, source_id, source_id),
+            )
+
+        remove_orphans(cur)
+
+    return len(changes)
+
+
+# Queries
+
+
+def get_property_usage(cur, site):
+    """
+    Returns every property used on the site, along with the values
+    it is set to and which pages use each value.
+
+    Values are case-insensitive (as in find_declarations()), so they are
+    grouped and listed by their lowercase form.
+
+    Each entry is (property, [(value, slugs, page_count)], page_count).
+    """
+
+    # lower() folds the same (ASCII) characters as NOCASE,
+    # so the ordering and the grouping below agree.
+    rows = cur.execute(
+        f"""
+        SELECT DISTINCT
+            css_declarations.property,
+            lower(css_declarations.value) AS value,
+            pages.slug
+        FROM css_postings
+        JOIN css_declarations
+            ON css_declarations.source_id = css_postings.source_id
+        JOIN pages
+            ON pages.url = css_postings.page_url
+        WHERE {get_site_filter("css_postings.page_url")}
+        ORDER BY css_declarations.property, lower(css_declarations.value), pages.slug
+        """,
+        get_site_filter_params(site),
+    )
+
+    entries = []
+    for property, property_rows in groupby(rows, key=itemgetter(0)):
+        values = []
+        slugs = set()
+
+        for value, value_rows in groupby(property_rows, key=itemgetter(1)):
+            value_slugs = [slug for _, _, slug in value_rows]
+            values.append((value, value_slugs, len(value_slugs)))
+            slugs.update(value_slugs)
+
+        values.sort(key=itemgetter(2), reverse=True)
+        entries.append((property, values, len(slugs)))
+
+    entries.sort(key=itemgetter(2), reverse=True)
+    return entries
+
+
+def get_selector_usage(cur, site):
+    """
+    Returns every selector used on the site, along with the pages using it.
+
+    Each entry is (selector, slugs, page_count).
+    """
+
+    rows = cur.execute(
+        f"""
+        SELECT DISTINCT css_declarations.selector, pages.slug
+        FROM css_postings
+        JOIN css_declarations
+            ON css_declarations.source_id = css_postings.source_id
+        JOIN pages
+            ON pages.url = css_postings.page_url
+        WHERE {get_site_filter("css_postings.page_url")}
+        AND css_declarations.selector IS NOT NULL
+        ORDER BY css_declarations.selector, pages.slug
+        """,
+        get_site_filter_params(site),
+    )
+
+    entries = []
+    for selector, selector_rows in groupby(rows, key=itemgetter(0)):
+        slugs = [slug for _, slug in selector_rows]
+        entries.append((selector, slugs, len(slugs)))
+
+    entries.sort(key=itemgetter(2), reverse=True)
+    return entries
+
+
+def find_declarations(cur, property=None, value=None, selector=None):
+    """
+    Yields (page_url, extract_type, selector, property, value)
+    for every declaration matching all of the given conditions.
+    Properties and values match case-insensitively, but selectors
+    (such as class names and IDs) are case-sensitive, as in CSS.
+    """
+
+    conditions = []
+    params = []
+
+    for column, argument in (
+        ("property", property),
+        ("value", value),
+        ("selector", selector),
+    ):
+        if argument is not None:
+            conditions.append(f"css_declarations.{column} = ?")
+            params.append(argument)
+
+    where = " AND ".join(conditions) if conditions else "1"
+
+    return cur.execute(
+        f"""
+        SELECT
+            css_postings.page_url,
+            css_postings.extract_type,
+            css_declarations.selector,
+            css_declarations.property,
+            css_declarations.value
+        FROM css_declarations
+        JOIN css_postings
+            ON css_postings.source_id = css_declarations.source_id
+        WHERE {where}
+        ORDER BY css_postings.page_url
+        """,
+        params,
+    )
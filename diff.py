@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""
+Compares two crawl databases, such as the results from two releases.
+
+Both page tables are read in URL order and merge-joined, so memory use stays
+flat however many pages there are. Pages are compared by their content hashes
+rather than their sources (older snapshots without stored hashes have them
+computed as they are read), and extracts are only read for pages which were
+added, removed, or changed. Neither snapshot is modified.
+"""
+
+import os
+import re
+import sqlite3
+import sys
+from argparse import ArgumentParser
+from collections import Counter, namedtuple
+
+from store import EXTRACT_KEYS, EXTRACT_TYPES, PageStore, SchemaError, get_content_hash
+
+WIKIDOT_URL_REGEX = re.compile(r"^https?://([^\.]+)\.wikidot\.com/(.+)")
+REGEX_WHITESPACE = re.compile(r"\s+")
+
+COMPARED_COLUMNS = ("slug", "title", "category", "created_at", "content_hash")
+PAGE_COLUMNS = ("url", *COMPARED_COLUMNS)
+
+EXTRACT_PREVIEW_LENGTH = 72
+
+PageDelta = namedtuple("PageDelta", ("status", "url", "fields", "extracts"))
+ExtractDelta = namedtuple("ExtractDelta", ("extract_type", "added", "removed"))
+
+
+# Comparison
+
+
+def merge_join(old_pages, new_pages):
+    """
+    Pairs up two streams of pages ordered by URL.
+    Yields (old, new), where either is None if the page is only on one side.
+    """
+
+    old = next(old_pages, None)
+    new = next(new_pages, None)
+
+    while old is not None or new is not None:
+        if new is None or (old is not None and old["url"] < new["url"]):
+            yield old, None
+            old = next(old_pages, None)
+        elif old is None or new["url"] < old["url"]:
+            yield None, new
+            new = next(new_pages, None)
+        else:
+            yield old, new
+            old = next(old_pages, None)
+            new = next(new_pages, None)
+
+
+def get_extract_deltas(old_extracts, new_extracts):
+    """
+    Compares extracts as multisets, since only their positions
+    change when something is inserted earlier in a page.
+    """
+
+    deltas = []
+
+    for extract_type in EXTRACT_TYPES:
+        old = Counter(old_extracts.get(extract_type, ()))
+        new = Counter(new_extracts.get(extract_type, ()))
+        added = list((new - old).elements())
+        removed = list((old - new).elements())
+
+        if added or removed:
+            deltas.append(ExtractDelta(extract_type, added, removed))
+
+    return deltas
+
+
+def diff_stores(old_store, new_store, sites=None):
+    """
+    Yields a PageDelta for every page which was added, removed, or changed.
+    """
+
+    empty = {extract_type: () for extract_type in EXTRACT_TYPES}
+    pairs = merge_join(
+        old_store.iter_pages(sites, columns=PAGE_COLUMNS, order_by="url"),
+        new_store.iter_pages(sites, columns=PAGE_COLUMNS, order_by="url"),
+    )
+
+    for old, new in pairs:
+        if old is None:
+            extracts = new_store.get_page_extracts(new["url"])
+            yield PageDelta(
+                "added", new["url"], (), get_extract_deltas(empty, extracts)
+            )
+        elif new is None:
+            extracts = old_store.get_page_extracts(old["url"])
+            yield PageDelta(
+                "removed", old["url"], (), get_extract_deltas(extracts, empty)
+            )
+        else:
+            fields = [
+                column for column in COMPARED_COLUMNS if old[column] != new[column]
+            ]
+            if not fields:
+                continue
+
+            if "content_hash" in fields:
+                extracts = get_extract_deltas(
+                    old_store.get_page_extracts(old["url"]),
+                    new_store.get_page_extracts(new["url"]),
+                )
+            else:
+                extracts = []
+
+            yield PageDelta("changed", new["url"], fields, extracts)
+
+
+# Printing results
+
+
+def get_page_name(url):
+    match = WIKIDOT_URL_REGEX.match(url)
+    return url if match is None else f"{match[1]}/{match[2]}"
+
+
+def get_extract_preview(extract_type, source):
+    if extract_type == "module_style":
+        lines = source.count("\n") + 1
+        return f"[{get_content_hash(source)[:10]}, {lines} lines]"
+
+    preview = REGEX_WHITESPACE.sub(" ", source).strip()
+    if len(preview) > EXTRACT_PREVIEW_LENGTH:
+        preview = preview[: EXTRACT_PREVIEW_LENGTH - 3] + "..."
+
+    return preview
+
+
+def print_delta(delta, show_extracts):
+    marker = {"added": "+", "removed": "-", "changed": "~"}[delta.status]
+    fields = ["source" if field == "content_hash" else field for field in delta.fields]
+    details = f" ({', '.join(fields)})" if fields else ""
+    print(f"{marker} {get_page_name(delta.url)}{details}")
+
+    if show_extracts and delta.status == "changed":
+        for extract_delta in delta.extracts:
+            for source in extract_delta.added:
+                preview = get_extract_preview(extract_delta.extract_type, source)
+                print(f"    + {extract_delta.extract_type}: {preview}")
+
+            for source in extract_delta.removed:
+                preview = get_extract_preview(extract_delta.extract_type, source)
+                print(f"    - {extract_delta.extract_type}: {preview}")
+
+
+def print_summary(pages, extracts):
+    print(
+        f"Pages: {pages['added']:,} added, {pages['removed']:,} removed, "
+        f"{pages['changed']:,} changed"
+    )
+
+    for extract_type, name in EXTRACT_KEYS:
+        added = extracts[(extract_type, "added")]
+        removed = extracts[(extract_type, "removed")]
+        print(f"  {name:<14} +{added:<8,} -{removed:,}")
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description="Compare two crawl databases")
+    argparser.add_argument(
+        "-S",
+        "--site",
+        default=None,
+        dest="filter_sites",
+        help="Only compare pages from the following sites (comma-separated)",
+    )
+    argparser.add_argument(
+        "--summary",
+        action="store_true",
+        default=False,
+        help="Only print the totals, not each changed page",
+    )
+    argparser.add_argument(
+        "--no-extracts",
+        action="store_false",
+        default=True,
+        dest="show_extracts",
+        help="Don't list the added and removed extracts of changed pages",
+    )
+    argparser.add_argument(
+        "old",
+        help="The earlier SQLite file",
+    )
+    argparser.add_argument(
+        "new",
+        help="The later SQLite file",
+    )
+    args = argparser.parse_args()
+    sites = args.filter_sites.split(",") if args.filter_sites else None
+
+    for path in (args.old, args.new):
+        if not os.path.exists(path):
+            argparser.error(f"No such database: {path}")
+
+    try:
+        # Read-only, so the snapshots aren't modified.
+        # Older ones have their hashes computed when read.
+        old_store = PageStore(args.old, readonly=True)
+        new_store = PageStore(args.new, readonly=True)
+    except (sqlite3.DatabaseError, SchemaError) as error:
+        print(f"Unable to open database: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    page_counts = Counter()
+    extract_counts = Counter()
+
+    for delta in diff_stores(old_store, new_store, sites):
+        page_counts[delta.status] += 1
+
+        for extract_delta in delta.extracts:
+            extract_type = extract_delta.extract_type
+            extract_counts[(extract_type, "added")] += len(extract_delta.added)
+            extract_counts[(extract_type, "removed")] += len(extract_delta.removed)
+
+        if not args.summary:
+            print_delta(delta, args.show_extracts)
+
+    if page_counts and not args.summary:
+        print()
+
+    print_summary(page_counts, extract_counts)
+
+    old_store.close()
+    new_store.close()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+"""
+Exports the crawl results as compressed, sharded files for releases.
+
+Each site's pages, and each type of extract, are written to their own series
+of gzipped NDJSON or CSV shards, so consumers can download only what they need.
+Every row has the same flat columns, listed in the manifest.
+
+The shards are written in parallel, one worker per site and table, and a new
+shard is started once the current one reaches the size cap. Sizes are counted
+after compression, so shards may run slightly over while the compressor flushes.
+Output is reproducible: the same database always gives byte-identical shards.
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import sys
+from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from config import DEFAULT_CONFIG_PATH, Configuration
+from store import EXTRACT_TYPES, PAGE_COLUMNS, PageStore, SchemaError
+
+DEFAULT_OUTPUT_DIRECTORY = os.path.join("output", "export")
+DEFAULT_MAX_SIZE = 50  # MiB
+MANIFEST_FILENAME = "manifest.json"
+FORMATS = ("ndjson", "csv")
+
+EXPORT_PAGE_COLUMNS = (*PAGE_COLUMNS, "content_hash")
+EXPORT_EXTRACT_COLUMNS = ("page_url", "extract_type", "extract_index", "source")
+
+ExportJob = namedtuple(
+    "ExportJob",
+    ("database_path", "output_directory", "site", "table", "format", "max_size"),
+)
+
+Shard = namedtuple("Shard", ("path", "site", "table", "rows", "size", "sha256"))
+
+
+class HashingWriter:
+    """
+    Wraps a binary file, tracking the size and SHA-256 of everything written.
+    """
+
+    __slots__ = ("file", "hash", "size")
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+
+class ShardWriter:
+    """
+    Writes one shard, as gzipped NDJSON or CSV.
+    """
+
+    def __init__(self, path, format, columns):
+        self.path = path
+        self.format = format
+        self.columns = columns
+        self.rows = 0
+        self.file = open(path, "wb")
+        self.output = HashingWriter(self.file)
+
+        # A fixed mtime, so the same rows always give the same checksum
+        self.gzip = gzip.GzipFile(filename="", mode="wb", fileobj=self.output, mtime=0)
+        self.text = io.TextIOWrapper(self.gzip, encoding="utf-8", newline="")
+
+        if format == "csv":
+            self.csv = csv.writer(self.text)
+            self.csv.writerow(columns)
+
+    @property
+    def size(self):
+        return self.output.size
+
+    def write(self, row):
+        if self.format == "csv":
+            self.csv.writerow(row)
+        else:
+            data = dict(zip(self.columns, row))
+            self.text.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+            self.text.write("\n")
+
+        self.rows += 1
+
+    def close(self):
+        self.text.close()
+        self.file.close()
+
+
+def get_jobs(database_path, output_directory, sites, format, max_size):
+    tables = ["pages", *(f"extracts-{extract_type}" for extract_type in EXTRACT_TYPES)]
+    return [
+        ExportJob(database_path, output_directory, site, table, format, max_size)
+        for site in sites
+        for table in tables
+    ]
+
+
+def get_rows(store, site, table):
+    if table == "pages":
+        return EXPORT_PAGE_COLUMNS, store.iter_pages(
+            [site],
+            columns=EXPORT_PAGE_COLUMNS,
+            order_by=None,
+        )
+    else:
+        extract_type = table.split("-", 1)[1]
+        return EXPORT_EXTRACT_COLUMNS, store.iter_extract_rows(
+            [site],
+            extract_types=(extract_type,),
+        )
+
+
+def export_table(job):
+    """
+    Writes the shards for one site and table.
+
+    This runs in a worker process, so it opens its own (read-only) store.
+    Returns the list of shards written.
+    """
+
+    store = PageStore(job.database_path, readonly=True)
+    columns, rows = get_rows(store, job.site, job.table)
+    directory = os.path.join(job.output_directory, job.site)
+    os.makedirs(directory, exist_ok=True)
+
+    shards = []
+    writer = None
+
+    def finish():
+        writer.close()
+        shards.append(
+            Shard(
+                path=os.path.relpath(writer.path, job.output_directory),
+                site=job.site,
+                table=job.table,
+                rows=writer.rows,
+                size=writer.size,
+                sha256=writer.output.hash.hexdigest(),
+            )
+        )
+
+    for row in rows:
+        if writer is not None and writer.size >= job.max_size:
+            finish()
+            writer = None
+
+        if writer is None:
+            path = os.path.join(
+                directory,
+                f"{job.table}-{len(shards):04}.{job.format}.gz",
+            )
+            writer = ShardWriter(path, job.format, columns)
+
+        writer.write(tuple(row))
+
+    # Empty tables get no shards
+    if writer is not None:
+        finish()
+
+    store.close()
+    return shards
+
+
+def remove_previous_export(output_directory):
+    """
+    Deletes the shards listed in a previous export's manifest, and the manifest.
+    Anything else in the directory is left alone. Raises ValueError if
+    the directory has other files but no manifest, since it isn't an export.
+    """
+
+    manifest_path = os.path.join(output_directory, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        if os.path.isdir(output_directory) and os.listdir(output_directory):
+            raise ValueError(
+                f"Output directory is not empty and has no {MANIFEST_FILENAME}: "
+                f"{output_directory}"
+            )
+
+        return
+
+    with open(manifest_path, encoding="utf-8") as file:
+        manifest = json.load(file)
+
+    root = os.path.realpath(output_directory)
+    directories = set()
+
+    for shard in manifest["shards"]:
+        path = os.path.realpath(os.path.join(root, shard["path"]))
+
+        # Never follow a manifest outside of the export
+        if os.path.commonpath((root, path)) != root:
+            continue
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        directories.add(os.path.dirname(path))
+
+    os.remove(manifest_path)
+
+    # Site directories are removed only once they're empty
+    for directory in directories:
+        if directory != root and not os.listdir(directory):
+            os.rmdir(directory)
+
+
+def write_manifest(output_directory, format, shards):
+    columns = {"pages": EXPORT_PAGE_COLUMNS}
+    for extract_type in EXTRACT_TYPES:
+        columns[f"extracts-{extract_type}"] = EXPORT_EXTRACT_COLUMNS
+
+    manifest = {
+        "created_at": datetime.utcnow().isoformat(),
+        "format": format,
+        "compression": "gzip",
+        "columns": columns,
+        "shards": [shard._asdict() for shard in shards],
+    }
+
+    path = os.path.join(output_directory, MANIFEST_FILENAME)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description="Export the crawl results as compressed shards")
+    argparser.add_argument(
+        "-s",
+        "--site",
+        action="append",
+        default=None,
+        dest="sites",
+        help="Only export this site (may be repeated)",
+    )
+    argparser.add_argument(
+        "-f",
+        "--format",
+        default="ndjson",
+        choices=FORMATS,
+        help="The format of each shard, before compression",
+    )
+    argparser.add_argument(
+        "--max-size",
+        type=float,
+        default=DEFAULT_MAX_SIZE,
+        dest="max_size",
+        help=f"The size at which to start a new shard, in MiB (default {DEFAULT_MAX_SIZE})",
+    )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="How many shards to write in parallel",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output",
+        default=DEFAULT_OUTPUT_DIRECTORY,
+        dest="output_directory",
+        help="The directory to write the shards and manifest to (replacing any previous export)",
+    )
+    argparser.add_argument(
+        "config",
+        nargs="?",
+        default=DEFAULT_CONFIG_PATH,
+        help=f"The configuration file to use (default {DEFAULT_CONFIG_PATH})",
+    )
+    args = argparser.parse_args()
+
+    config = Configuration(args.config)
+    sites = args.sites or config.sites
+
+    for site in sites:
+        if site not in config.sites:
+            argparser.error(f"Site not in configuration: {site}")
+
+    if args.max_size <= 0:
+        argparser.error("The maximum shard size must be positive")
+
+    try:
+        # Checked up front, rather than failing in every worker
+        PageStore(config.output_path, readonly=True).close()
+    except (sqlite3.DatabaseError, SchemaError) as error:
+        print(f"Unable to open database: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        remove_previous_export(args.output_directory)
+    except ValueError as error:
+        argparser.error(str(error))
+
+    os.makedirs(args.output_directory, exist_ok=True)
+
+    jobs = get_jobs(
+        config.output_path,
+        args.output_directory,
+        sites,
+        args.format,
+        int(args.max_size * 1024 * 1024),
+    )
+    workers = max(1, min(args.jobs or 1, len(jobs)))
+
+    print(f"Exporting {len(sites)} sites with {workers} workers...")
+    if workers == 1:
+        results = [export_table(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(export_table, jobs))
+
+    shards = [shard for result in results for shard in result]
+    write_manifest(args.output_directory, args.format, shards)
+
+    rows = sum(shard.rows for shard in shards)
+    size = sum(shard.size for shard in shards)
+    print(f"Wrote {rows:,} rows to {len(shards)} shards ({size / (1024 * 1024):.1f} MiB)")
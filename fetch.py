@@ -3,18 +3,21 @@
 import asyncio
 import itertools
 import json
-import os
 import re
-import sqlite3
+import subprocess
 import sys
 import time
 import traceback
+from argparse import ArgumentParser
 from asyncio.exceptions import CancelledError
+from collections import namedtuple
 
 import aiohttp
 from dateutil.parser import isoparse
 
-from config import Configuration
+import includegraph
+from config import DEFAULT_CONFIG_PATH, Configuration
+from store import PageStore
 
 REGEX_CROM_RATE_LIMIT = re.compile(r"(?:in|for) (\d+) seconds?")
 REGEX_WIKIDOT_URL = re.compile(r"^https?://([\w\-]+)\.wikidot\.com/(.+)$")
@@ -37,6 +40,7 @@ REGEX_CLASSES = re.compile(
 
 CROM_ENDPOINT = "https://api.crom.avn.sh/graphql"
 CROM_RETRIES = 3
+CROM_CONNECTIONS = 4
 CROM_HEADERS = {
     "Accept-Encoding": "gzip, deflate, br",
     "Content-Type": "application/json",
@@ -51,6 +55,7 @@ CROM_QUERY = """
             wikidotInfo: {
                 createdAt: {
                     gte: $lastCreatedAt,
+                    lt: $createdBefore,
                 },
             },
         },
@@ -81,10 +86,7 @@ CROM_QUERY = """
 }
 """
 
-SQLITE_SEED_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
-
-with open(SQLITE_SEED_PATH) as file:
-    SQLITE_SEED = file.read()
+Partition = namedtuple("Partition", ("sites", "created_from", "created_before"))
 
 
 def format_date(iso_date):
@@ -133,106 +135,108 @@ class CromError(RuntimeError):
         return None
 
 
+def get_partition(config, sites=None, created_from=None, created_before=None):
+    """
+    Describes the slice of pages one crawler is responsible for,
+    so several machines can each crawl part of the configured sites.
+    Dates are ISO 8601, and the range includes its start but not its end.
+    """
+
+    for site in sites or ():
+        if site not in config.sites:
+            raise ValueError(f"Site not in configuration: {site}")
+
+    for date in (created_from, created_before):
+        try:
+            if date is not None:
+                isoparse(date)
+        except ValueError:
+            raise ValueError(f"Invalid date: {date}")
+
+    return Partition(
+        sites=sorted(sites or config.sites),
+        created_from=created_from,
+        created_before=created_before,
+    )
+
+
+def get_partition_key(config, partition):
+    """
+    Identifies the partition in the crawler state, so each partition
+    resumes from its own position. Full crawls use the empty key,
+    which is what databases from before partitioning have.
+    """
+
+    if partition is None or partition == get_partition(config):
+        return ""
+
+    created_from = partition.created_from or ""
+    created_before = partition.created_before or ""
+    return f"sites={','.join(partition.sites)};created={created_from}..{created_before}"
+
+
 class Crawler:
-    def __init__(self, config):
-        self.config = config
-        self.path = config.output_path
-        self.connect()
+    def __init__(
+        self, config, partition=None, path=None, store=None, incremental=False
+    ):
+        """
+        With incremental=True, pages which haven't changed since they were
+        stored are skipped, and the URLs of changed pages are collected in
+        changed_urls. A shared store may be passed in, which is left open by close().
+        """
 
-    def connect(self):
-        database_exists = os.path.exists(config.output_path)
-        self.conn = sqlite3.connect(self.path)
-        if database_exists:
+        self.config = config
+        self.partition = partition or get_partition(config)
+        self.partition_key = get_partition_key(config, self.partition)
+        self.path = path or config.output_path
+        self.incremental = incremental
+        self.changed_urls = set()
+        self.connect(store)
+
+    def connect(self, store=None):
+        self.owns_store = store is None
+        self.store = PageStore(self.path) if store is None else store
+        self.cursor, self.last_created_at = self.store.load_state(self.partition_key)
+        self.saved_state = (self.cursor, self.last_created_at)
+
+        if self.last_created_at is not None:
             print("Loaded previous crawler state")
-
-            with self.conn as cur:
-                result = cur.execute(
-                    "SELECT cursor_state, last_created_at FROM crawler_state"
-                )
-                self.cursor, self.last_created_at = result.fetchone()
         else:
             print("No previous crawler state, starting fresh")
+            self.last_created_at = self.partition.created_from
+
+        with self.store.writer() as conn:
+            includegraph.ensure_graph(conn)
 
-            with self.conn as cur:
-                cur.executescript(SQLITE_SEED)
+    def save_state(self):
+        # Crawls which finish in one batch never get a cursor,
+        # but their position is still worth saving.
+        state = (self.cursor, self.last_created_at)
+        if self.last_created_at is None or state == self.saved_state:
+            return
 
-            self.cursor = None
-            self.last_created_at = None
+        self.store.save_state(
+            self.cursor,
+            self.last_created_at,
+            self.partition_key,
+        )
+        self.saved_state = state
 
     def close(self):
-        with self.conn as cur:
-            cur.execute("DELETE FROM crawler_state")
-            cur.execute(
-                """
-                INSERT INTO crawler_state
-                (cursor_state, last_created_at)
-                VALUES
-                (?, ?)
-                """,
-                (self.cursor, self.last_created_at),
-            )
+        if self.store is None:
+            return
 
-        self.conn.close()
-        self.conn = None
+        self.save_state()
 
-    def write_page(self, page):
-        with self.conn as cur:
-            cur.execute(
-                """
-                INSERT INTO pages
-                (url, slug, title, category, created_at, wikidot_page_id, source)
-                VALUES
-                (?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT (url)
-                DO UPDATE
-                SET
-                    slug = ?,
-                    title = ?,
-                    category = ?,
-                    created_at = ?,
-                    wikidot_page_id = ?,
-                    source = ?
-                """,
-                (
-                    page["url"],
-                    page["slug"],
-                    page["title"],
-                    page["category"],
-                    page["created_at"],
-                    page["wikidot_page_id"],
-                    page["source"],
-                    page["slug"],
-                    page["title"],
-                    page["category"],
-                    page["created_at"],
-                    page["wikidot_page_id"],
-                    page["source"],
-                ),
-            )
+        if self.owns_store:
+            self.store.close()
 
-            cur.execute("DELETE FROM extracts WHERE page_url = ?", (page["url"],))
-
-            def add_extracts(extract_type, extracts):
-                for idx, extract in enumerate(extracts):
-                    cur.execute(
-                        """
-                        INSERT INTO extracts
-                        (page_url, extract_index, extract_type, source)
-                        VALUES
-                        (?, ?, ?, ?)
-                        """,
-                        (
-                            page["url"],
-                            idx,
-                            extract_type,
-                            extract,
-                        ),
-                    )
-
-            add_extracts("module_style", page["module_styles"])
-            add_extracts("inline_style", page["inline_styles"])
-            add_extracts("include", page["includes"])
-            add_extracts("class", page["classes"])
+        self.store = None
+
+    def write_page(self, page):
+        written = self.store.write_page(page, skip_unchanged=self.incremental)
+        if written and self.incremental:
+            self.changed_urls.add(page["url"])
 
     async def raw_request(self, session, query, variables):
         for key, value in variables.items():
@@ -263,8 +267,11 @@ class Crawler:
 
     async def next_pages(self, session):
         variables = {
-            "$anyBaseUrl": self.config.crom_base_urls,
+            "$anyBaseUrl": [
+                f"http://{site}.wikidot.com/" for site in self.partition.sites
+            ],
             "$lastCreatedAt": self.last_created_at,
+            "$createdBefore": self.partition.created_before,
             "$cursor": self.cursor,
         }
 
@@ -342,39 +349,263 @@ class Crawler:
             print("Making another attempt...")
         print("Giving up...")
 
-    async def fetch_all(self):
+    async def fetch_all(self, session=None):
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self.fetch_all(session)
+
         has_next_page = True
         last_slug = Container()
 
-        async with aiohttp.ClientSession() as session:
+        async def pull_pages():
+            created_at = format_date(self.last_created_at)
+            print(
+                f"+ Requesting next batch of pages (last page '{last_slug}', created {created_at})"
+            )
+
+            # Make request
+            edges, has_next_page = await self.next_pages(session)
 
-            async def pull_pages():
-                created_at = format_date(self.last_created_at)
-                print(
-                    f"+ Requesting next batch of pages (last page '{last_slug}', created {created_at})"
-                )
+            # Parse out results
+            for edge in edges:
+                page, slug = self.process_edge(edge)
+                last_slug.set(slug)
 
-                # Make request
-                edges, has_next_page = await self.next_pages(session)
+                if page is not None:
+                    self.last_created_at = page["created_at"]
+                    self.write_page(page)
 
-                # Parse out results
-                for edge in edges:
-                    page, slug = self.process_edge(edge)
-                    last_slug.set(slug)
+            return has_next_page
 
-                    if page is not None:
-                        self.last_created_at = page["created_at"]
-                        self.write_page(page)
+        while has_next_page:
+            has_next_page = await self.retry(pull_pages)
 
-                return has_next_page
+        print("Hit the end, finished!")
 
-            while has_next_page:
-                has_next_page = await self.retry(pull_pages)
 
-            print("Hit the end, finished!")
+class SyncDaemon:
+    """
+    Keeps the database and the report fresh, by polling Crom for each site
+    on its own schedule and rebuilding only the pages which changed.
+
+    Each site is crawled by its own incremental crawler, which resumes from the
+    newest page it has seen. Since Crom can only be filtered by creation date,
+    edits to older pages are picked up by periodically re-sweeping every page,
+    where unchanged pages are skipped by their content hash.
+    """
+
+    def __init__(self, config, jobs=1, after_build=None):
+        self.config = config
+        self.jobs = jobs
+        self.after_build = after_build
+        self.store = PageStore(config.output_path)
+        self.crawlers = {}
+
+        # Sites without their own state continue from the last full crawl
+        _, last_created_at = self.store.load_state()
+
+        for site in config.sites:
+            print(f"Loading crawler for {site}...")
+            crawler = Crawler(
+                config,
+                get_partition(config, [site]),
+                store=self.store,
+                incremental=True,
+            )
+
+            if crawler.last_created_at is None:
+                crawler.last_created_at = last_created_at
+
+            self.crawlers[site] = crawler
+
+        now = time.monotonic()
+        self.next_sync = dict.fromkeys(config.sites, now)
+        self.next_resync = self.get_next_resync(now)
+
+        # Crawlers index pages as they write them, so after the first
+        # rebuild, only the changed pages need to be re-rendered.
+        self.indexes_updated = False
+
+    def get_next_resync(self, now):
+        if self.config.resync_interval <= 0:
+            return None
+
+        return now + self.config.resync_interval
+
+    def start_resync(self, now):
+        print("Starting a full re-sweep of every site")
+        for site, crawler in self.crawlers.items():
+            crawler.cursor = None
+            crawler.last_created_at = None
+            self.next_sync[site] = now
+
+        self.next_resync = self.get_next_resync(now)
+
+    def close(self):
+        for crawler in self.crawlers.values():
+            crawler.close()
+
+        self.store.close()
+
+    async def sync(self, session, site):
+        print(f"Syncing {site}...")
+        crawler = self.crawlers[site]
+        await crawler.fetch_all(session)
+        crawler.save_state()
+
+        interval = self.config.get_sync_interval(site)
+        self.next_sync[site] = time.monotonic() + interval
+
+    async def rebuild(self):
+        changed_slugs = {}
+        for site, crawler in self.crawlers.items():
+            if crawler.changed_urls:
+                changed_slugs[site] = {
+                    REGEX_WIKIDOT_URL.match(url)[2] for url in crawler.changed_urls
+                }
+                crawler.changed_urls.clear()
+
+        if not changed_slugs:
+            print("No pages changed")
+            return
+
+        pages = sum(len(slugs) for slugs in changed_slugs.values())
+        print(f"{pages} pages changed, rebuilding {len(changed_slugs)} sites")
+
+        # Only needed in daemon mode, so plain crawls don't load the build
+        from build import build_sites
+
+        # Builds are CPU-bound, so keep them off the event loop
+        await asyncio.to_thread(
+            build_sites,
+            self.config,
+            sorted(changed_slugs),
+            jobs=self.jobs,
+            changed_slugs=changed_slugs,
+            update_indexes=not self.indexes_updated,
+        )
+        self.indexes_updated = True
+
+        if self.after_build is not None:
+            print(f"Running '{self.after_build}'...")
+            result = await asyncio.to_thread(
+                subprocess.run,
+                self.after_build,
+                shell=True,
+            )
+
+            if result.returncode != 0:
+                print(f"Command failed with exit code {result.returncode}")
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=CROM_CONNECTIONS)
+
+        async with aiohttp.ClientSession(connector=connector) as session:
+            while True:
+                now = time.monotonic()
+                if self.next_resync is not None and now >= self.next_resync:
+                    self.start_resync(now)
+
+                for site, next_sync in self.next_sync.items():
+                    if next_sync <= now:
+                        await self.sync(session, site)
+
+                await self.rebuild()
+
+                wake = min(self.next_sync.values())
+                if self.next_resync is not None:
+                    wake = min(wake, self.next_resync)
+
+                delay = wake - time.monotonic()
+                if delay > 0:
+                    print(f"Sleeping for {delay:.0f} seconds")
+                    await asyncio.sleep(delay)
 
 
 if __name__ == "__main__":
-    config = Configuration()
-    crawler = Crawler(config)
+    argparser = ArgumentParser(description="Fetch page sources from Crom")
+    argparser.add_argument(
+        "-s",
+        "--site",
+        action="append",
+        default=None,
+        dest="sites",
+        help="Only crawl this site (may be repeated)",
+    )
+    argparser.add_argument(
+        "--created-from",
+        default=None,
+        dest="created_from",
+        help="Only crawl pages created at or after this date (ISO 8601)",
+    )
+    argparser.add_argument(
+        "--created-before",
+        default=None,
+        dest="created_before",
+        help="Only crawl pages created before this date (ISO 8601)",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        dest="output_path",
+        help="Write to this SQLite file instead of the configured one",
+    )
+    argparser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=False,
+        help="Keep running, polling each site for changes and rebuilding the report",
+    )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="How many sites to rebuild in parallel (with --daemon)",
+    )
+    argparser.add_argument(
+        "--after-build",
+        default=None,
+        dest="after_build",
+        help="A shell command to run after each rebuild, such as to publish it (with --daemon)",
+    )
+    argparser.add_argument(
+        "config",
+        nargs="?",
+        default=DEFAULT_CONFIG_PATH,
+        help=f"The configuration file to use (default {DEFAULT_CONFIG_PATH})",
+    )
+    args = argparser.parse_args()
+    config = Configuration(args.config)
+
+    if args.daemon:
+        if args.sites or args.created_from or args.created_before:
+            argparser.error("The daemon always syncs every configured site")
+
+        if args.output_path is not None:
+            argparser.error("The daemon always writes to the configured database")
+
+        daemon = SyncDaemon(config, args.jobs, args.after_build)
+        try:
+            asyncio.run(daemon.run())
+        except KeyboardInterrupt:
+            print("Stopping...")
+        finally:
+            daemon.close()
+
+        sys.exit(0)
+
+    try:
+        partition = get_partition(
+            config,
+            sites=args.sites,
+            created_from=args.created_from,
+            created_before=args.created_before,
+        )
+    except ValueError as error:
+        argparser.error(str(error))
+
+    crawler = Crawler(config, partition, args.output_path)
     asyncio.run(crawler.fetch_all())
+    crawler.close()
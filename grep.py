@@ -8,6 +8,9 @@ from collections import namedtuple
 
 from colorama import Fore, Style
 
+from config import Configuration
+from store import PageStore, SchemaError
+
 WIKIDOT_SITE_REGEX = re.compile(r"^https?://([^\.]+)\.wikidot\.com/.+")
 USE_COLOR = None
 
@@ -51,17 +54,10 @@ def eprint(message):
     print(message, file=sys.stderr)
 
 
-def load(path):
-    with open(path, encoding="utf-8") as file:
-        data = json.load(file)
-
-    return data["pages"]
-
-
 # Search
 
 
-def grep(conn, regex, options):
+def grep(store, regex, options):
     if options.invert:
 
         def line_matches(line):
@@ -75,31 +71,29 @@ def grep(conn, regex, options):
 
     page_matches = {}
 
-    with conn as cur:
-        result = cur.execute("SELECT url, slug, source FROM pages")
-        for url, slug, source in result:
-            site = WIKIDOT_SITE_REGEX.match(url)[1]
-            lines = source.split("\n")
-
-            if options.sites:
-                # Check site filter
-                if site not in options.sites:
-                    continue
-
-            matches = []
-            for i, line in enumerate(lines):
-                spans = line_matches(line)
-                if spans:
-                    matches.append(
-                        Match(
-                            line_number=i,
-                            line_content=line,
-                            spans=spans,
-                        )
+    pages = store.iter_pages(
+        options.sites,
+        columns=("url", "slug", "source"),
+        order_by=None,
+    )
+    for url, slug, source in pages:
+        site = WIKIDOT_SITE_REGEX.match(url)[1]
+        lines = source.split("\n")
+
+        matches = []
+        for i, line in enumerate(lines):
+            spans = line_matches(line)
+            if spans:
+                matches.append(
+                    Match(
+                        line_number=i,
+                        line_content=line,
+                        spans=spans,
                     )
+                )
 
-            if matches:
-                page_matches[(site, slug)] = matches
+        if matches:
+            page_matches[(site, slug)] = matches
 
     return page_matches
 
@@ -222,6 +216,12 @@ if __name__ == "__main__":
         dest="filter_sites",
         help="Only search from the following sites (comma-separated)",
     )
+    argparser.add_argument(
+        "-c",
+        "--config",
+        default="config.toml",
+        help="The configuration file, which specifies the database to search",
+    )
     argparser.add_argument(
         "pattern",
         help="The regular expression to search for",
@@ -229,8 +229,8 @@ if __name__ == "__main__":
     argparser.add_argument(
         "path",
         nargs="?",
-        default="output/results.json",
-        help="The file containing page sources to look through",
+        default=None,
+        help="The SQLite file containing page sources to look through (default from the configuration)",
     )
     args = argparser.parse_args()
     options = get_regex_options(args)
@@ -247,6 +247,14 @@ if __name__ == "__main__":
         eprint(f"Invalid regular expression: {error}")
         sys.exit(1)
 
-    with sqlite3.connect(args.path) as conn:
-        results = grep(conn, regex, options)
-        print_grep_results(results, args.compact)
+    path = args.path or Configuration(args.config).output_path
+
+    try:
+        store = PageStore(path, readonly=True)
+    except (sqlite3.DatabaseError, SchemaError) as error:
+        eprint(f"Unable to open database: {error}")
+        sys.exit(1)
+
+    results = grep(store, regex, options)
+    store.close()
+    print_grep_results(results, args.compact)
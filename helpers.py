@@ -0,0 +1,62 @@
+import hashlib
+import re
+from functools import lru_cache
+
+INCLUDE_REGEX = re.compile(r"^(?::([a-z0-9\-]+):)?([a-z0-9\-:_]+)$", re.IGNORECASE)
+SCP_SLUG_REGEX = re.compile(r"^scp-([0-9]+)(.*)$", re.IGNORECASE)
+
+# Bounds the memoization caches below, so all-sites builds
+# (which see hundreds of thousands of distinct values) don't grow unbounded.
+HELPER_CACHE_SIZE = 1 << 16
+
+
+def get_site_filter(column):
+    # Page URLs are the primary key, so selecting a site by URL prefix range
+    # lets SQLite use the index instead of scanning every page.
+    return f"(({column} >= ? AND {column} < ?) OR ({column} >= ? AND {column} < ?))"
+
+
+def get_site_filter_params(site):
+    params = []
+    for scheme in ("http", "https"):
+        prefix = f"{scheme}://{site}.wikidot.com/"
+        params.append(prefix)
+        # The character after '/' is '0', which closes the range
+        params.append(f"{prefix[:-1]}0")
+
+    return params
+
+
+@lru_cache(maxsize=HELPER_CACHE_SIZE)
+def parse_include(include):
+    """
+    Splits an include target into (site, page).
+    The site is None if the include is local.
+
+    Returns None if the include target is not valid.
+    """
+
+    match = INCLUDE_REGEX.match(include)
+    if match is None:
+        return None
+
+    return match.groups()
+
+
+@lru_cache(maxsize=HELPER_CACHE_SIZE)
+def page_slug_key(slug):
+    if slug.startswith("adult:"):
+        return page_slug_key(slug[6:])
+
+    match = SCP_SLUG_REGEX.match(slug)
+    if match is None:
+        return slug
+    else:
+        number = int(match[1])
+        suffix = match[2]
+        return f"scp-{number:07}{suffix}"
+
+
+@lru_cache(maxsize=HELPER_CACHE_SIZE)
+def sha1_hex(data):
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
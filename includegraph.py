@@ -0,0 +1,351 @@
+"""
+Dependency graph of [[include]]s between pages.
+
+Pages are identified by keys of the form "site/slug", so include targets which
+were never crawled still appear in the graph. Where the target was crawled,
+its stored URL is recorded on the edge.
+
+Alongside the forward edges, the transitive closure is kept in a table of
+(target, page, depth) rows, meaning "page includes target, depth levels deep".
+This turns impact analysis ("what is affected if this component changes?")
+into an indexed lookup. Both are maintained incrementally as pages are written.
+"""
+
+import re
+from collections import defaultdict, deque
+from datetime import datetime
+
+REGEX_WIKIDOT_URL = re.compile(r"^https?://([\w\-]+)\.wikidot\.com/(.+)$")
+REGEX_INCLUDE_SITE = re.compile(r"^:([a-z0-9\-.]+):(.+)$")
+
+INCLUDE_GRAPH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS include_edges (
+    page_key TEXT NOT NULL,
+    target_key TEXT NOT NULL,
+    target_url TEXT,
+
+    PRIMARY KEY (page_key, target_key)
+);
+
+CREATE INDEX IF NOT EXISTS include_edges_target
+ON include_edges (target_key);
+
+CREATE TABLE IF NOT EXISTS include_closure (
+    target_key TEXT NOT NULL,
+    page_key TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+
+    PRIMARY KEY (target_key, page_key)
+);
+
+CREATE INDEX IF NOT EXISTS include_closure_page
+ON include_closure (page_key);
+
+CREATE TABLE IF NOT EXISTS include_graph_state (
+    built_at TEXT NOT NULL
+);
+"""
+
+
+# Keys
+
+
+def get_page_key(url):
+    match = REGEX_WIKIDOT_URL.match(url)
+    if match is None:
+        return None
+
+    site, slug = match.groups()
+    return f"{site}/{slug.lower()}"
+
+
+def get_include_key(current_site, include):
+    include = "".join(include.split()).lower()
+
+    match = REGEX_INCLUDE_SITE.match(include)
+    if match is None:
+        return f"{current_site}/{include}"
+
+    site, slug = match.groups()
+    return f"{site}/{slug}"
+
+
+def get_key_urls(key):
+    site, slug = key.split("/", 1)
+    return [f"{scheme}://{site}.wikidot.com/{slug}" for scheme in ("http", "https")]
+
+
+def resolve_key(cur, key):
+    result = cur.execute(
+        "SELECT url FROM pages WHERE url IN (?, ?)",
+        get_key_urls(key),
+    ).fetchone()
+
+    return None if result is None else result[0]
+
+
+# Graph maintenance
+
+
+def ensure_graph(conn):
+    """
+    Builds the graph from the stored extracts if it has never been built.
+    """
+
+    with conn as cur:
+        (built,) = cur.execute("SELECT COUNT(*) FROM include_graph_state").fetchone()
+
+    if not built:
+        rebuild_graph(conn)
+
+
+def get_descendants(cur, key):
+    """
+    Returns {target_key: depth} for everything the page includes, transitively.
+    """
+
+    rows = cur.execute(
+        "SELECT target_key, depth FROM include_closure WHERE page_key = ?",
+        (key,),
+    )
+    return dict(rows)
+
+
+def get_ancestors(cur, key):
+    """
+    Returns {page_key: depth} for every page including this one, transitively.
+    """
+
+    rows = cur.execute(
+        "SELECT page_key, depth FROM include_closure WHERE target_key = ?",
+        (key,),
+    )
+    return dict(rows)
+
+
+def refresh_closure(cur, targets):
+    """
+    Recomputes the closure rows for the given targets,
+    by walking the reverse edges from each of them.
+    """
+
+    for target in targets:
+        cur.execute("DELETE FROM include_closure WHERE target_key = ?", (target,))
+
+        depths = {}
+        queue = deque([(target, 0)])
+        while queue:
+            key, depth = queue.popleft()
+            rows = cur.execute(
+                "SELECT page_key FROM include_edges WHERE target_key = ?",
+                (key,),
+            ).fetchall()
+
+            for (page_key,) in rows:
+                if page_key not in depths and page_key != target:
+                    depths[page_key] = depth + 1
+                    queue.append((page_key, depth + 1))
+
+        cur.executemany(
+            """
+            INSERT INTO include_closure
+            (target_key, page_key, depth)
+            VALUES
+            (?, ?, ?)
+            """,
+            ((target, page_key, depth) for page_key, depth in depths.items()),
+        )
+
+
+def update_page(cur, url, includes):
+    """
+    Replaces a page's outgoing edges, and updates the closure to match.
+
+    Adding edges only ever adds closure rows, which can be derived from the
+    existing closure directly. Removing edges requires recomputing the rows
+    for the removed targets and everything they include, since only paths
+    through them can have changed.
+    """
+
+    key = get_page_key(url)
+    if key is None:
+        return
+
+    site = key.split("/", 1)[0]
+    old_targets = {
+        target
+        for (target,) in cur.execute(
+            "SELECT target_key FROM include_edges WHERE page_key = ?",
+            (key,),
+        )
+    }
+    new_targets = {get_include_key(site, include) for include in includes}
+    new_targets.discard(key)
+
+    # Update edges
+    cur.execute("DELETE FROM include_edges WHERE page_key = ?", (key,))
+    cur.executemany(
+        """
+        INSERT INTO include_edges
+        (page_key, target_key, target_url)
+        VALUES
+        (?, ?, ?)
+        """,
+        ((key, target, resolve_key(cur, target)) for target in new_targets),
+    )
+    cur.execute(
+        "UPDATE include_edges SET target_url = ? WHERE target_key = ?",
+        (url, key),
+    )
+
+    # Update closure
+    removed = old_targets - new_targets
+    added = new_targets - old_targets
+
+    if removed:
+        affected = set(removed)
+        for target in removed:
+            affected.update(get_descendants(cur, target))
+
+        refresh_closure(cur, affected)
+
+    if added:
+        ancestors = get_ancestors(cur, key)
+        ancestors[key] = 0
+
+        for target in added:
+            descendants = get_descendants(cur, target)
+            descendants[target] = 0
+
+            cur.executemany(
+                """
+                INSERT INTO include_closure
+                (target_key, page_key, depth)
+                VALUES
+                (?, ?, ?)
+                ON CONFLICT (target_key, page_key)
+                DO UPDATE
+                SET depth = MIN(depth, excluded.depth)
+                """,
+                (
+                    (descendant, ancestor, up + 1 + down)
+                    for descendant, down in descendants.items()
+                    for ancestor, up in ancestors.items()
+                    if descendant != ancestor
+                ),
+            )
+
+
+def rebuild_graph(conn):
+    """
+    Builds the whole graph from the stored include extracts.
+    """
+
+    print("Building include graph...")
+
+    with conn as cur:
+        cur.execute("DELETE FROM include_edges")
+        cur.execute("DELETE FROM include_closure")
+        cur.execute("DELETE FROM include_graph_state")
+
+        urls = {}
+        for (url,) in cur.execute("SELECT url FROM pages"):
+            key = get_page_key(url)
+            if key is not None:
+                urls[key] = url
+
+        edges = set()
+        rows = cur.execute(
+            "SELECT page_url, source FROM extracts WHERE extract_type = 'include'"
+        )
+        for url, include in rows:
+            key = get_page_key(url)
+            if key is None:
+                continue
+
+            site = key.split("/", 1)[0]
+            target = get_include_key(site, include)
+            if target != key:
+                edges.add((key, target))
+
+        cur.executemany(
+            """
+            INSERT INTO include_edges
+            (page_key, target_key, target_url)
+            VALUES
+            (?, ?, ?)
+            """,
+            ((key, target, urls.get(target)) for key, target in edges),
+        )
+
+        # Compute the closure in memory, rather than through refresh_closure(),
+        # since here every target needs to be walked.
+        reverse_edges = defaultdict(list)
+        for key, target in edges:
+            reverse_edges[target].append(key)
+
+        for target in reverse_edges:
+            depths = {}
+            queue = deque([(target, 0)])
+            while queue:
+                key, depth = queue.popleft()
+                for page_key in reverse_edges.get(key, ()):
+                    if page_key not in depths and page_key != target:
+                        depths[page_key] = depth + 1
+                        queue.append((page_key, depth + 1))
+
+            cur.executemany(
+                """
+                INSERT INTO include_closure
+                (target_key, page_key, depth)
+                VALUES
+                (?, ?, ?)
+                """,
+                ((target, page_key, depth) for page_key, depth in depths.items()),
+            )
+
+        cur.execute(
+            "INSERT INTO include_graph_state (built_at) VALUES (?)",
+            (datetime.utcnow().isoformat(),),
+        )
+
+
+# Queries
+
+
+def get_impact(cur, key, max_depth=None):
+    """
+    Returns (page_key, page_url, depth) for every page which includes
+    the given page, directly or through nested includes, nearest first.
+    """
+
+    query = """
+        SELECT include_closure.page_key, pages.url, include_closure.depth
+        FROM include_closure
+        LEFT JOIN pages
+            ON pages.url IN (
+                'http://' || replace(include_closure.page_key, '/', '.wikidot.com/'),
+                'https://' || replace(include_closure.page_key, '/', '.wikidot.com/')
+            )
+        WHERE include_closure.target_key = ?
+    """
+    params = [key]
+
+    if max_depth is not None:
+        query += " AND include_closure.depth <= ?"
+        params.append(max_depth)
+
+    query += " ORDER BY include_closure.depth, include_closure.page_key"
+    return cur.execute(query, params)
+
+
+def get_impact_counts(cur):
+    """
+    Returns {target_key: page_count} for every included page,
+    counting pages which include it transitively.
+    """
+
+    rows = cur.execute(
+        "SELECT target_key, COUNT(*) FROM include_closure GROUP BY target_key"
+    )
+    return dict(rows)
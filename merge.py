@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Merges crawl databases into one, such as the partitions of a distributed crawl.
+"""
+
+import os
+import sqlite3
+import sys
+from argparse import ArgumentParser
+
+from config import Configuration
+from cssindex import update_index
+from includegraph import rebuild_graph
+from store import PageStore
+from themes import update_signatures
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description="Merge crawl databases into one")
+    argparser.add_argument(
+        "-c",
+        "--config",
+        default="config.toml",
+        help="The configuration file, which specifies the database to merge into",
+    )
+    argparser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        dest="output_path",
+        help="Merge into this SQLite file instead of the configured one",
+    )
+    argparser.add_argument(
+        "sources",
+        nargs="+",
+        help="The SQLite files to merge in",
+    )
+    args = argparser.parse_args()
+    output_path = args.output_path or Configuration(args.config).output_path
+
+    for path in args.sources:
+        if not os.path.exists(path):
+            argparser.error(f"No such database: {path}")
+
+        if os.path.abspath(path) == os.path.abspath(output_path):
+            argparser.error(f"Cannot merge a database into itself: {path}")
+
+    store = PageStore(output_path)
+    changed = 0
+
+    try:
+        for path in args.sources:
+            print(f"Merging {path}...")
+            added, replaced = store.merge(path)
+            changed += added + replaced
+            print(f"+ {added} pages added, {replaced} pages replaced")
+    except sqlite3.DatabaseError as error:
+        print(f"Unable to merge {path}: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    if changed:
+        print("Updating indexes...")
+        with store.writer() as conn:
+            update_index(conn)
+            update_signatures(conn)
+            rebuild_graph(conn)
+
+    store.close()
@@ -0,0 +1,219 @@
+import cProfile
+import json
+import time
+import tracemalloc
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+
+PhaseTiming = namedtuple("PhaseTiming", ("name", "seconds", "peak_memory"))
+RenderTiming = namedtuple("RenderTiming", ("template", "output", "seconds"))
+
+DEFAULT_SLOWEST_COUNT = 20
+
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}"
+
+        size /= 1024
+
+
+class BuildProfiler:
+    """
+    Collects wall time and peak memory per build phase,
+    as well as render time per template and output file.
+
+    When disabled, every method is a cheap pass-through, so build code
+    can use it unconditionally.
+    """
+
+    def __init__(
+        self,
+        enabled=False,
+        cprofile_path=None,
+        slowest_count=DEFAULT_SLOWEST_COUNT,
+    ):
+        self.enabled = enabled
+        self.cprofile_path = cprofile_path
+        self.slowest_count = slowest_count
+        self.phases = []
+        self.renders = []
+        self.calls = defaultdict(lambda: [0, 0.0])
+        self.cprofile = None
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        if not self.enabled:
+            return
+
+        # tracemalloc noticeably slows down allocation-heavy code,
+        # so it is only turned on while profiling.
+        tracemalloc.start()
+
+        if self.cprofile_path is not None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+        self.started_at = time.perf_counter()
+
+    def stop(self):
+        if not self.enabled:
+            return
+
+        self.finished_at = time.perf_counter()
+
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_path)
+
+        tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            _, peak_memory = tracemalloc.get_traced_memory()
+            self.phases.append(PhaseTiming(name, seconds, peak_memory))
+
+    def render(self, template, output, **context):
+        if not self.enabled:
+            return template.render(**context)
+
+        start = time.perf_counter()
+        html = template.render(**context)
+        seconds = time.perf_counter() - start
+        self.renders.append(RenderTiming(template.name, output, seconds))
+        return html
+
+    def wrap(self, name, func):
+        """
+        Wraps a helper function (such as a Jinja filter), so its
+        call count and cumulative time appear in the report.
+        """
+
+        if not self.enabled:
+            return func
+
+        counter = self.calls[name]
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                counter[0] += 1
+                counter[1] += time.perf_counter() - start
+
+        return wrapper
+
+    def wrap_iter(self, name, iterable):
+        """
+        Wraps an iterable (such as a streamed database query), so the time
+        spent producing its items appears in the report, separately from
+        the time spent consuming them. The count is the number of items.
+        """
+
+        if not self.enabled:
+            return iterable
+
+        counter = self.calls[name]
+        done = object()
+
+        def wrapper():
+            iterator = iter(iterable)
+
+            while True:
+                start = time.perf_counter()
+                item = next(iterator, done)
+                counter[1] += time.perf_counter() - start
+
+                if item is done:
+                    return
+
+                counter[0] += 1
+                yield item
+
+        return wrapper()
+
+    def report(self):
+        templates = defaultdict(lambda: {"count": 0, "seconds": 0.0, "max": 0.0})
+        for render in self.renders:
+            entry = templates[render.template]
+            entry["count"] += 1
+            entry["seconds"] += render.seconds
+            entry["max"] = max(entry["max"], render.seconds)
+
+        slowest = sorted(self.renders, key=lambda render: render.seconds)
+        slowest.reverse()
+
+        if self.started_at is None or self.finished_at is None:
+            total = sum(phase.seconds for phase in self.phases)
+        else:
+            total = self.finished_at - self.started_at
+
+        return {
+            "total_seconds": total,
+            "phases": [phase._asdict() for phase in self.phases],
+            "templates": dict(templates),
+            "slowest_pages": [
+                render._asdict() for render in slowest[: self.slowest_count]
+            ],
+            "calls": {
+                name: {"count": count, "seconds": seconds}
+                for name, (count, seconds) in self.calls.items()
+            },
+        }
+
+
+def print_report(report, title="Build profile"):
+    print()
+    print(f"{title} ({report['total_seconds']:.3f}s total)")
+
+    print("  Phases:")
+    for phase in report["phases"]:
+        print(
+            f"    {phase['name']:<32} {phase['seconds']:>9.3f}s"
+            f"  peak {format_bytes(phase['peak_memory'])}"
+        )
+
+    print("  Templates:")
+    templates = sorted(
+        report["templates"].items(),
+        key=lambda item: item[1]["seconds"],
+        reverse=True,
+    )
+    for name, entry in templates:
+        mean = entry["seconds"] / entry["count"]
+        print(
+            f"    {name:<32} {entry['seconds']:>9.3f}s"
+            f"  ({entry['count']} renders, mean {mean * 1000:.2f}ms,"
+            f" max {entry['max'] * 1000:.2f}ms)"
+        )
+
+    if report["calls"]:
+        print("  Helpers:")
+        for name, entry in report["calls"].items():
+            print(
+                f"    {name:<32} {entry['seconds']:>9.3f}s"
+                f"  ({entry['count']} calls)"
+            )
+
+    print("  Slowest pages:")
+    for render in report["slowest_pages"]:
+        print(f"    {render['output']:<48} {render['seconds'] * 1000:>9.2f}ms")
+
+
+def write_report(report, path):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
@@ -15,14 +15,25 @@ trap on_exit EXIT SIGINT SIGTERM
 set -x
 
 [[ -f output/index.html ]]
-[[ -f output/pages/index.html ]]
-[[ -f output/pages/scp-001.html ]]
+
+# Single-site builds write the report directly into output/,
+# multi-site builds write one directory per site (see build.py).
+report_dirs=()
+for dir in output/*/; do
+	dir="${dir%/}"
+	[[ $dir == output/cache ]] && continue
+	[[ -f $dir/index.html ]] || continue
+	report_dirs+=("$dir")
+done
+
+# Search index for the page list of single-site builds
+[[ -d output/search ]] && report_dirs+=(output/search)
 
 # NOTE: we aren't copying the SQLite file,
 # it's too big and we don't want to use GitHub LFS
 # instead it is published via GitHub releases
 
-cp -a static output/*.html output/pages  "$temp_dir"
+cp -a static output/*.html "${report_dirs[@]}" "$temp_dir"
 git checkout gh-pages
 cp -a "$temp_dir"/* .
 git add .
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import re
+import sqlite3
+import sys
+from argparse import ArgumentParser
+
+import cssindex
+import includegraph
+from config import Configuration
+from store import PageStore
+
+WIKIDOT_URL_REGEX = re.compile(r"^https?://([^\.]+)\.wikidot\.com/(.+)")
+
+# Utility functions
+
+
+def get_sites(args):
+    if args.filter_sites:
+        return args.filter_sites.split(",")
+    else:
+        return None
+
+
+def split_url(url):
+    match = WIKIDOT_URL_REGEX.match(url)
+    return match[1], match[2]
+
+
+def split_key(key):
+    site, slug = key.split("/", 1)
+    return site, slug
+
+
+# Commands
+
+
+def update_indexes(store, args):
+    with store.writer() as conn:
+        changed = cssindex.update_index(conn)
+        print(f"CSS index: {changed} extracts updated")
+
+        includegraph.ensure_graph(conn)
+        if args.rebuild:
+            includegraph.rebuild_graph(conn)
+
+        (edges,) = conn.execute("SELECT COUNT(*) FROM include_edges").fetchone()
+        print(f"Include graph: {edges} edges")
+
+
+def query_css(store, args):
+    sites = get_sites(args)
+
+    with store.reader() as conn:
+        rows = cssindex.find_declarations(
+            conn,
+            property=getattr(args, "property", None),
+            value=getattr(args, "value", None),
+            selector=getattr(args, "selector", None),
+        )
+
+        for page_url, extract_type, selector, property, value in rows:
+            site, slug = split_url(page_url)
+            if sites and site not in sites:
+                continue
+
+            if extract_type == "inline_style":
+                rule = f'style="{property}: {value}"'
+            else:
+                rule = f"{selector} {{ {property}: {value} }}"
+
+            print(f"({site}) {slug}: {rule}")
+
+
+def query_impact(store, args):
+    sites = get_sites(args)
+    key = includegraph.get_include_key(args.site, args.page)
+
+    with store.reader() as conn:
+        rows = includegraph.get_impact(conn, key, args.max_depth).fetchall()
+
+    for page_key, url, depth in rows:
+        site, slug = split_key(page_key)
+        if sites and site not in sites:
+            continue
+
+        note = "" if url is not None else " (not crawled)"
+        print(f"({site}) {slug}: depth {depth}{note}")
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description="Query the indexes built over crawled pages")
+    argparser.add_argument(
+        "-c",
+        "--config",
+        default="config.toml",
+        help="The configuration file, which specifies the database to use",
+    )
+    argparser.add_argument(
+        "-S",
+        "--site",
+        default=None,
+        dest="filter_sites",
+        help="Only show results from the following sites (comma-separated)",
+    )
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+
+    index_parser = subparsers.add_parser(
+        "index",
+        help="Bring the indexes up to date with the crawled pages",
+    )
+    index_parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        default=False,
+        help="Rebuild the include graph from scratch",
+    )
+    index_parser.set_defaults(func=update_indexes)
+
+    impact_parser = subparsers.add_parser(
+        "impact",
+        help="Find pages which include a page, directly or through nested includes",
+    )
+    impact_parser.add_argument(
+        "page",
+        help="The included page, as written in [[include]], e.g. ':scp-wiki:component:theme'",
+    )
+    impact_parser.add_argument(
+        "--from-site",
+        default="scp-wiki",
+        dest="site",
+        help="The site to resolve includes without an explicit site against",
+    )
+    impact_parser.add_argument(
+        "-d",
+        "--max-depth",
+        type=int,
+        default=None,
+        dest="max_depth",
+        help="Only show pages up to this many levels of includes away",
+    )
+    impact_parser.set_defaults(func=query_impact)
+
+    property_parser = subparsers.add_parser(
+        "property",
+        help="Find pages which set a CSS property (optionally to a given value)",
+    )
+    property_parser.add_argument("property", help="The CSS property, e.g. 'position'")
+    property_parser.add_argument("value", nargs="?", help="The value, e.g. 'fixed'")
+    property_parser.set_defaults(func=query_css)
+
+    value_parser = subparsers.add_parser(
+        "value",
+        help="Find pages which set any CSS property to a given value",
+    )
+    value_parser.add_argument("value", help="The value, e.g. 'fixed'")
+    value_parser.set_defaults(func=query_css)
+
+    selector_parser = subparsers.add_parser(
+        "selector",
+        help="Find pages which style a CSS selector",
+    )
+    selector_parser.add_argument("selector", help="The selector, e.g. '#page-content'")
+    selector_parser.add_argument(
+        "-p",
+        "--property",
+        default=None,
+        help="Only show declarations for this property",
+    )
+    selector_parser.set_defaults(func=query_css)
+
+    args = argparser.parse_args()
+    config = Configuration(args.config)
+
+    store = PageStore(config.output_path)
+    try:
+        args.func(store, args)
+    except sqlite3.OperationalError as error:
+        print(f"Unable to query database: {error}", file=sys.stderr)
+        print("Run 'query.py index' to build the indexes first.", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        store.close()
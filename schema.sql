@@ -1,9 +1,9 @@
-CREATE TABLE crawler_state (
+CREATE TABLE IF NOT EXISTS crawler_state (
     cursor_state TEXT NOT NULL,
     last_created_at TEXT NOT NULL
 );
 
-CREATE TABLE pages (
+CREATE TABLE IF NOT EXISTS pages (
     url TEXT PRIMARY KEY,
     slug TEXT NOT NULL,
     title TEXT NOT NULL,
@@ -13,7 +13,7 @@ CREATE TABLE pages (
     source TEXT NOT NULL
 );
 
-CREATE TABLE extracts (
+CREATE TABLE IF NOT EXISTS extracts (
     page_url TEXT NOT NULL,
     extract_type TEXT NOT NULL,
     extract_index INTEGER NOT NULL,
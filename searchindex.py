@@ -0,0 +1,187 @@
+"""
+Static, sharded search index for the page listing.
+
+Rather than one giant HTML table, the page index loads small JSON files:
+
+* manifest.json, describing the fields, shards, and orderings.
+* prefix/<prefix>.json, the pages whose slug starts with that prefix.
+  Prefixes are extended until each shard is small enough,
+  so large groups like "scp-" are split into "scp-1", "scp-2", etc.
+* title/<name>.json, the pages with a word in their title starting with
+  that prefix, split the same way. Titles may be in any script, so the
+  filename is the prefix's code points in hex, separated by dashes.
+* sorted/<field>/<n>.json, fixed-size pages of rows in ascending order by
+  that field. Descending order is read from the end.
+
+Each row is a list, in the order given by the manifest's "fields".
+"""
+
+import json
+import os
+import re
+import shutil
+from collections import defaultdict
+
+from helpers import get_site_filter, get_site_filter_params, page_slug_key
+
+SEARCH_DIRECTORY = "search"
+SHARD_SIZE = 1000
+SORTED_PAGE_SIZE = 100
+MAX_PREFIX_LENGTH = 12
+
+REGEX_UNSAFE_PREFIX = re.compile(r"[^a-z0-9\-]")
+REGEX_TITLE_WORD = re.compile(r"[^\W_]+")
+
+FIELDS = (
+    "slug",
+    "title",
+    "category",
+    "module_styles",
+    "inline_styles",
+    "classes",
+    "includes",
+    "length",
+)
+
+SORT_KEYS = {
+    "slug": lambda row: page_slug_key(row[0]),
+    "title": lambda row: (page_slug_key(row[1]), page_slug_key(row[0])),
+    "module_styles": lambda row: (row[3], page_slug_key(row[0])),
+    "inline_styles": lambda row: (row[4], page_slug_key(row[0])),
+    "classes": lambda row: (row[5], page_slug_key(row[0])),
+    "includes": lambda row: (row[6], page_slug_key(row[0])),
+    "length": lambda row: (row[7], page_slug_key(row[0])),
+}
+
+
+def get_prefix(slug, length):
+    # Prefixes double as filenames, so anything unusual is replaced
+    return REGEX_UNSAFE_PREFIX.sub("_", slug[:length].lower())
+
+
+def get_rows(cur, site):
+    return cur.execute(
+        f"""
+        SELECT
+            pages.slug,
+            pages.title,
+            pages.category,
+            COALESCE(SUM(extracts.extract_type = 'module_style'), 0),
+            COALESCE(SUM(extracts.extract_type = 'inline_style'), 0),
+            COALESCE(SUM(extracts.extract_type = 'class'), 0),
+            COALESCE(SUM(extracts.extract_type = 'include'), 0),
+            LENGTH(pages.source)
+        FROM pages
+        LEFT JOIN extracts
+            ON extracts.page_url = pages.url
+        WHERE {get_site_filter("pages.url")}
+        GROUP BY pages.url
+        ORDER BY pages.slug
+        """,
+        get_site_filter_params(site),
+    ).fetchall()
+
+
+def split_shards(rows, length=1):
+    """
+    Groups rows by slug prefix, lengthening the prefix
+    for any group which is still larger than SHARD_SIZE.
+    """
+
+    groups = defaultdict(list)
+    for row in rows:
+        groups[get_prefix(row[0], length)].append(row)
+
+    shards = {}
+    for prefix, group in groups.items():
+        # Slugs shorter than the prefix can't be split any further
+        splittable = any(len(row[0]) > length for row in group)
+
+        if len(group) > SHARD_SIZE and length < MAX_PREFIX_LENGTH and splittable:
+            shards.update(split_shards(group, length + 1))
+        else:
+            shards[prefix] = group
+
+    return shards
+
+
+def get_title_words(title):
+    # Sorted, so the shards come out the same on every build
+    return sorted(set(REGEX_TITLE_WORD.findall((title or "").lower())))
+
+
+def get_title_shard_name(prefix):
+    return "-".join(f"{ord(char):x}" for char in prefix)
+
+
+def split_title_shards(entries, length=1):
+    """
+    Like split_shards(), but over (word, row) pairs for each word in the titles.
+    A page is listed once in a shard, however many of its words match.
+    """
+
+    groups = defaultdict(list)
+    for entry in entries:
+        groups[entry[0][:length]].append(entry)
+
+    shards = {}
+    for prefix, group in groups.items():
+        rows = list({row[0]: row for _, row in group}.values())
+        splittable = any(len(word) > length for word, _ in group)
+
+        if len(rows) > SHARD_SIZE and length < MAX_PREFIX_LENGTH and splittable:
+            shards.update(split_title_shards(group, length + 1))
+        else:
+            shards[prefix] = rows
+
+    return shards
+
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, separators=(",", ":"))
+
+
+def write_search_index(cur, site, output_directory):
+    rows = [tuple(row) for row in get_rows(cur, site)]
+    directory = os.path.join(output_directory, SEARCH_DIRECTORY)
+
+    # Clear out shards from any previous build
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(os.path.join(directory, "prefix"))
+    os.makedirs(os.path.join(directory, "title"))
+
+    shards = split_shards(rows)
+    for prefix, shard in shards.items():
+        write_json(os.path.join(directory, "prefix", f"{prefix}.json"), shard)
+
+    title_entries = [(word, row) for row in rows for word in get_title_words(row[1])]
+    title_shards = split_title_shards(title_entries)
+    for prefix, shard in title_shards.items():
+        name = get_title_shard_name(prefix)
+        write_json(os.path.join(directory, "title", f"{name}.json"), shard)
+
+    for field, key in SORT_KEYS.items():
+        ordered = sorted(rows, key=key)
+        field_directory = os.path.join(directory, "sorted", field)
+        os.makedirs(field_directory)
+
+        for i, start in enumerate(range(0, len(ordered), SORTED_PAGE_SIZE)):
+            chunk = ordered[start : start + SORTED_PAGE_SIZE]
+            write_json(os.path.join(field_directory, f"{i}.json"), chunk)
+
+    write_json(
+        os.path.join(directory, "manifest.json"),
+        {
+            "fields": FIELDS,
+            "count": len(rows),
+            "page_size": SORTED_PAGE_SIZE,
+            "orders": list(SORT_KEYS),
+            "shards": {prefix: len(shard) for prefix, shard in shards.items()},
+            "title_shards": {
+                prefix: len(shard) for prefix, shard in title_shards.items()
+            },
+        },
+    )
+
+    return len(rows)
@@ -0,0 +1,354 @@
+// Page index, backed by the sharded search index written by build.py.
+// See searchindex.py for the layout of the JSON files.
+
+var PAGE_SEARCH_MAX_SHARDS = 32;
+
+var PAGE_SEARCH_ALERTS = {
+  module_styles: 3,
+  inline_styles: 10,
+  classes: 10,
+  length: 200000,
+};
+
+function PageSearch(table) {
+  this.table = table;
+  this.basePath = table.dataset.basePath;
+  this.searchPath = table.dataset.searchPath;
+  this.cache = {};
+  this.manifest = null;
+  this.order = 'slug';
+  this.descending = false;
+  this.page = 0;
+  this.query = '';
+  this.results = null;
+}
+
+PageSearch.prototype.fetch = function (path) {
+  if (!(path in this.cache)) {
+    this.cache[path] = fetch(this.searchPath + '/' + path).then(function (response) {
+      if (!response.ok) {
+        throw new Error('Unable to load ' + path + ': ' + response.status);
+      }
+
+      return response.json();
+    });
+  }
+
+  return this.cache[path];
+};
+
+PageSearch.prototype.field = function (name) {
+  return this.manifest.fields.indexOf(name);
+};
+
+PageSearch.prototype.init = function () {
+  var self = this;
+
+  return this.fetch('manifest.json').then(function (manifest) {
+    self.manifest = manifest;
+    return self.update();
+  });
+};
+
+PageSearch.prototype.pageCount = function () {
+  var count = this.results === null ? this.manifest.count : this.results.length;
+  return Math.max(1, Math.ceil(count / this.manifest.page_size));
+};
+
+// Loads one page of rows, in the current order, when not searching.
+PageSearch.prototype.loadSortedPage = function () {
+  var size = this.manifest.page_size;
+  var count = this.manifest.count;
+  var low, high;
+
+  if (this.descending) {
+    high = count - 1 - this.page * size;
+    low = Math.max(0, high - size + 1);
+  } else {
+    low = this.page * size;
+    high = Math.min(count - 1, low + size - 1);
+  }
+
+  if (high < low) {
+    return Promise.resolve([]);
+  }
+
+  var chunks = [];
+  for (var i = Math.floor(low / size); i <= Math.floor(high / size); i++) {
+    chunks.push(this.fetch('sorted/' + this.order + '/' + i + '.json'));
+  }
+
+  var descending = this.descending;
+  return Promise.all(chunks).then(function (chunks) {
+    var offset = Math.floor(low / size) * size;
+    var rows = [].concat.apply([], chunks).slice(low - offset, high - offset + 1);
+
+    if (descending) {
+      rows.reverse();
+    }
+
+    return rows;
+  });
+};
+
+// Must match REGEX_TITLE_WORD in searchindex.py
+var PAGE_SEARCH_TITLE_WORD = /[\p{L}\p{N}]+/gu;
+
+function getTitleWords(title) {
+  return (title || '').toLowerCase().match(PAGE_SEARCH_TITLE_WORD) || [];
+}
+
+function getTitleShardName(prefix) {
+  return Array.from(prefix).map(function (char) {
+    return char.codePointAt(0).toString(16);
+  }).join('-');
+}
+
+// Returns the shards which could contain keys starting with the prefix,
+// or null if there are too many to load.
+function findShards(shards, prefix) {
+  var matches = Object.keys(shards).filter(function (shard) {
+    return shard.indexOf(prefix) === 0 || prefix.indexOf(shard) === 0;
+  });
+
+  return matches.length > PAGE_SEARCH_MAX_SHARDS ? null : matches;
+}
+
+// Finds pages whose slug starts with the query, or whose title has words
+// starting with each word of the query. Only the shards which could
+// contain such pages are loaded.
+PageSearch.prototype.search = function (query) {
+  var self = this;
+  var lowerQuery = query.toLowerCase();
+  var slugShards = findShards(this.manifest.shards, lowerQuery.replace(/[^a-z0-9\-]/g, '_'));
+
+  // The longest word narrows down the title shards the most
+  var queryWords = getTitleWords(query);
+  var longestWord = queryWords.reduce(function (longest, word) {
+    return Array.from(word).length > Array.from(longest).length ? word : longest;
+  }, '');
+  var titleShards = longestWord ? findShards(this.manifest.title_shards, longestWord) : [];
+
+  if (slugShards === null && titleShards === null) {
+    return Promise.resolve(null);
+  }
+
+  var paths = (slugShards || []).map(function (shard) {
+    return 'prefix/' + shard + '.json';
+  }).concat((titleShards || []).map(function (shard) {
+    return 'title/' + getTitleShardName(shard) + '.json';
+  }));
+
+  var slugField = this.field('slug');
+  var titleField = this.field('title');
+
+  function matchesTitle(title) {
+    var words = getTitleWords(title);
+    return queryWords.length > 0 && queryWords.every(function (queryWord) {
+      return words.some(function (word) {
+        return word.indexOf(queryWord) === 0;
+      });
+    });
+  }
+
+  return Promise.all(paths.map(function (path) {
+    return self.fetch(path);
+  })).then(function (shards) {
+    var seen = {};
+
+    return [].concat.apply([], shards).filter(function (row) {
+      var slug = row[slugField];
+      if (slug in seen) {
+        return false;
+      }
+
+      seen[slug] = true;
+      return (slugShards !== null && slug.toLowerCase().indexOf(lowerQuery) === 0) ||
+        (titleShards !== null && matchesTitle(row[titleField]));
+    });
+  });
+};
+
+PageSearch.prototype.sortResults = function () {
+  var index = this.field(this.order);
+  var slugField = this.field('slug');
+  var sign = this.descending ? -1 : 1;
+
+  this.results.sort(function (x, y) {
+    var a = x[index];
+    var b = y[index];
+
+    if (typeof a === 'string') {
+      a = a.toLowerCase();
+      b = b.toLowerCase();
+    }
+
+    if (a < b) return -sign;
+    if (a > b) return sign;
+    return x[slugField] < y[slugField] ? -1 : 1;
+  });
+};
+
+PageSearch.prototype.update = function () {
+  var self = this;
+  var rows;
+
+  if (this.results === null) {
+    rows = this.loadSortedPage();
+  } else {
+    var start = this.page * this.manifest.page_size;
+    rows = Promise.resolve(this.results.slice(start, start + this.manifest.page_size));
+  }
+
+  return rows.then(function (rows) {
+    self.render(rows);
+  });
+};
+
+PageSearch.prototype.setQuery = function (query) {
+  var self = this;
+  this.query = query.trim();
+  this.page = 0;
+
+  if (!this.query) {
+    this.results = null;
+    this.setStatus('');
+    return this.update();
+  }
+
+  return this.search(this.query).then(function (results) {
+    if (results === null) {
+      self.setStatus('Too many matches, type more of the slug or title to search.');
+      return;
+    }
+
+    // Ignore stale responses if the query changed while loading
+    if (self.query !== query.trim()) {
+      return;
+    }
+
+    self.results = results;
+    self.sortResults();
+    self.setStatus(results.length + ' matching pages');
+    return self.update();
+  });
+};
+
+PageSearch.prototype.setOrder = function (order) {
+  if (this.order === order) {
+    this.descending = !this.descending;
+  } else {
+    this.order = order;
+    this.descending = order !== 'slug' && order !== 'title';
+  }
+
+  this.page = 0;
+
+  if (this.results !== null) {
+    this.sortResults();
+  }
+
+  return this.update();
+};
+
+PageSearch.prototype.setPage = function (page) {
+  this.page = Math.max(0, Math.min(page, this.pageCount() - 1));
+  return this.update();
+};
+
+PageSearch.prototype.setStatus = function (message) {
+  document.getElementById('page-search-status').textContent = message;
+};
+
+PageSearch.prototype.render = function (rows) {
+  var self = this;
+  var fields = this.manifest.fields;
+  var body = this.table.tBodies[0];
+  var fragment = document.createDocumentFragment();
+
+  rows.forEach(function (row) {
+    var tr = document.createElement('tr');
+    var slug = row[fields.indexOf('slug')];
+
+    var titleCell = document.createElement('td');
+    var link = document.createElement('a');
+    link.href = self.basePath + '/pages/' + slug + '.html';
+    link.textContent = row[fields.indexOf('title')];
+    titleCell.appendChild(link);
+    tr.appendChild(titleCell);
+
+    var slugCell = document.createElement('td');
+    var code = document.createElement('code');
+    code.textContent = slug;
+    slugCell.appendChild(code);
+    tr.appendChild(slugCell);
+
+    ['module_styles', 'inline_styles', 'classes', 'includes', 'length'].forEach(function (field) {
+      var value = row[fields.indexOf(field)];
+      var cell = document.createElement('td');
+      cell.className = 'number';
+
+      var span = document.createElement('span');
+      span.textContent = value.toLocaleString('en-US');
+      if (field in PAGE_SEARCH_ALERTS && value >= PAGE_SEARCH_ALERTS[field]) {
+        span.className = 'alert';
+      }
+
+      cell.appendChild(span);
+      tr.appendChild(cell);
+    });
+
+    fragment.appendChild(tr);
+  });
+
+  body.textContent = '';
+  body.appendChild(fragment);
+
+  document.getElementById('page-search-position').textContent =
+    'Page ' + (this.page + 1) + ' of ' + this.pageCount();
+};
+
+function initPageSearch() {
+  var table = document.getElementById('page-list');
+  if (!table || !table.dataset.searchPath) {
+    return;
+  }
+
+  var search = new PageSearch(table);
+  var input = document.getElementById('page-search');
+  var timeout = null;
+
+  input.addEventListener('input', function () {
+    clearTimeout(timeout);
+    timeout = setTimeout(function () {
+      search.setQuery(input.value);
+    }, 200);
+  });
+
+  var headers = table.tHead.querySelectorAll('th[data-order]');
+  for (var i = 0; i < headers.length; i++) {
+    headers[i].addEventListener('click', function (event) {
+      search.setOrder(event.currentTarget.dataset.order);
+    });
+  }
+
+  document.getElementById('page-search-previous').addEventListener('click', function () {
+    search.setPage(search.page - 1);
+  });
+
+  document.getElementById('page-search-next').addEventListener('click', function () {
+    search.setPage(search.page + 1);
+  });
+
+  search.init().catch(function (error) {
+    search.setStatus(String(error));
+    console.error(error);
+  });
+}
+
+// The script may load after the page has already been parsed
+if (document.readyState === 'loading') {
+  document.addEventListener('DOMContentLoaded', initPageSearch);
+} else {
+  initPageSearch();
+}
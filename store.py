@@ -0,0 +1,692 @@
+"""
+Shared access to the crawl results database.
+
+Every tool opens the database through a PageStore, so connection settings,
+schema migrations, and the common queries over pages and extracts live here.
+
+* Readers are read-only connections (opened with mode=ro), kept in a pool.
+* There is a single writer connection, serialized by a lock.
+* The schema is a numbered list of migrations, tracked with PRAGMA user_version.
+* Large result sets are streamed in batches, rather than fetched all at once.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+from urllib.parse import quote
+
+import cssindex
+import includegraph
+import themes
+from helpers import get_site_filter, get_site_filter_params
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
+
+with open(SCHEMA_PATH) as file:
+    BASE_SCHEMA = file.read()
+
+# Each migration is applied once, in order. Only ever append to this list.
+# The early migrations use "IF NOT EXISTS", since they predate versioning
+# and existing databases may already have their tables.
+MIGRATIONS = (
+    BASE_SCHEMA,
+    cssindex.CSS_INDEX_SCHEMA,
+    themes.THEME_SCHEMA,
+    includegraph.INCLUDE_GRAPH_SCHEMA,
+    # Separate crawler state for each partition (see fetch.py)
+    """
+    ALTER TABLE crawler_state ADD COLUMN partition_key TEXT NOT NULL DEFAULT '';
+    CREATE UNIQUE INDEX crawler_state_partition ON crawler_state (partition_key);
+    """,
+    # Hash of each page's source, so snapshots can be compared cheaply (see diff.py)
+    """
+    ALTER TABLE pages ADD COLUMN content_hash TEXT;
+    UPDATE pages SET content_hash = sha1_hex(source);
+    """,
+)
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+)
+
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+)
+
+READER_POOL_SIZE = 4
+STATEMENT_CACHE_SIZE = 256
+STREAM_BATCH_SIZE = 500
+
+PAGE_COLUMNS = (
+    "url",
+    "slug",
+    "title",
+    "category",
+    "created_at",
+    "wikidot_page_id",
+    "source",
+)
+
+# Extract types, and the page dictionary keys holding them (see Crawler.process_edge)
+EXTRACT_KEYS = (
+    ("module_style", "module_styles"),
+    ("inline_style", "inline_styles"),
+    ("include", "includes"),
+    ("class", "classes"),
+)
+
+EXTRACT_TYPES = tuple(extract_type for extract_type, _ in EXTRACT_KEYS)
+
+
+class SchemaError(RuntimeError):
+    pass
+
+
+def get_sites_filter(column, sites):
+    """
+    Returns a WHERE clause and its parameters,
+    matching rows from any of the given sites (or all sites if None).
+    """
+
+    if not sites:
+        return "1", ()
+
+    clauses = [get_site_filter(column) for _ in sites]
+    params = [param for site in sites for param in get_site_filter_params(site)]
+    return f"({' OR '.join(clauses)})", params
+
+
+def get_slugs_filter(column, sites, slugs):
+    """
+    Returns a WHERE clause and its parameters, matching the pages with
+    the given slugs on any of the given sites (or all pages if slugs is None).
+
+    The page URLs are passed as a single JSON array, so any number of slugs
+    fits in one parameter, and each page is looked up by its primary key.
+    """
+
+    if slugs is None:
+        return "1", ()
+
+    if not sites:
+        raise ValueError("Filtering by slug requires the sites to be given")
+
+    urls = [
+        f"{scheme}://{site}.wikidot.com/{slug}"
+        for site in sites
+        for scheme in ("http", "https")
+        for slug in sorted(slugs)
+    ]
+    return f"{column} IN (SELECT value FROM json_each(?))", (json.dumps(urls),)
+
+
+def get_content_hash(source):
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+def stream(cur, query, params=()):
+    """
+    Yields the rows of a query, fetching them in batches.
+    """
+
+    result = cur.execute(query, params)
+    while True:
+        rows = result.fetchmany(STREAM_BATCH_SIZE)
+        if not rows:
+            break
+
+        yield from rows
+
+
+class PageStore:
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.readers = []
+        self.readers_lock = threading.Lock()
+        self.writer_conn = None
+        self.writer_lock = threading.RLock()
+
+        if readonly:
+            self.check_version()
+        else:
+            self.migrate()
+
+        self.load_schema()
+
+    # Connections
+
+    def connect(self, readonly):
+        if readonly:
+            uri = f"file:{quote(os.path.abspath(self.path))}?mode=ro"
+            conn = sqlite3.connect(
+                uri,
+                uri=True,
+                check_same_thread=False,
+                cached_statements=STATEMENT_CACHE_SIZE,
+            )
+        else:
+            conn = sqlite3.connect(
+                self.path,
+                check_same_thread=False,
+                cached_statements=STATEMENT_CACHE_SIZE,
+            )
+
+            for pragma in WRITER_PRAGMAS:
+                conn.execute(pragma)
+
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+
+        conn.create_function("sha1_hex", 1, get_content_hash, deterministic=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """
+        Borrows a read-only connection from the pool.
+        """
+
+        with self.readers_lock:
+            conn = self.readers.pop() if self.readers else None
+
+        if conn is None:
+            conn = self.connect(readonly=True)
+
+        try:
+            yield conn
+        finally:
+            with self.readers_lock:
+                if len(self.readers) < READER_POOL_SIZE:
+                    self.readers.append(conn)
+                    conn = None
+
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def writer(self):
+        """
+        Holds the writer connection. Callers manage their own transactions,
+        usually with "with conn as cur:".
+        """
+
+        if self.readonly:
+            raise sqlite3.OperationalError("Store was opened read-only")
+
+        with self.writer_lock:
+            if self.writer_conn is None:
+                self.writer_conn = self.connect(readonly=False)
+
+            yield self.writer_conn
+
+    def close(self):
+        with self.readers_lock:
+            for conn in self.readers:
+                conn.close()
+
+            self.readers.clear()
+
+        with self.writer_lock:
+            if self.writer_conn is not None:
+                self.writer_conn.close()
+                self.writer_conn = None
+
+    # Migrations
+
+    def check_version(self):
+        """
+        Read-only stores can't be migrated, so older databases are used as
+        they are, as long as they have the tables being queried (see require()).
+        Missing content hashes are computed as pages are read.
+        """
+
+        with self.reader() as conn:
+            (self.version,) = conn.execute("PRAGMA user_version").fetchone()
+
+    def load_schema(self):
+        with self.reader() as conn:
+            self.tables = {
+                name
+                for (name,) in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'"
+                )
+            }
+            self.page_columns = {
+                row["name"] for row in conn.execute("PRAGMA table_info(pages)")
+            }
+
+        self.require("pages", "extracts")
+
+    def require(self, *tables):
+        for table in tables:
+            if table not in self.tables:
+                raise SchemaError(
+                    f"Database has no {table} table (schema version {self.version}, "
+                    f"expected {SCHEMA_VERSION}), open it for writing first to migrate"
+                )
+
+    def migrate(self):
+        with self.writer() as conn:
+            (version,) = conn.execute("PRAGMA user_version").fetchone()
+            if version > SCHEMA_VERSION:
+                raise SchemaError(
+                    f"Database schema version {version} is newer than this code "
+                    f"(version {SCHEMA_VERSION})"
+                )
+
+            for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+                # executescript() commits first, so the version is bumped
+                # in the same script to keep each migration atomic.
+                conn.executescript(
+                    f"BEGIN;\n{migration}\nPRAGMA user_version = {number};\nCOMMIT;"
+                )
+
+        self.version = max(version, SCHEMA_VERSION)
+
+    # Crawler state
+
+    def load_state(self, partition_key=""):
+        """
+        Returns (cursor, last_created_at) from the previous crawl
+        of this partition, or (None, None) if there is none.
+        The cursor is None if the crawl never got past its first batch.
+        """
+
+        with self.writer() as conn:
+            result = conn.execute(
+                """
+                SELECT cursor_state, last_created_at FROM crawler_state
+                WHERE partition_key = ?
+                """,
+                (partition_key,),
+            ).fetchone()
+
+        if result is None:
+            return None, None
+
+        cursor, last_created_at = result
+        return cursor or None, last_created_at
+
+    def save_state(self, cursor, last_created_at, partition_key=""):
+        # cursor_state is NOT NULL, so a missing cursor is stored as ""
+        cursor = "" if cursor is None else cursor
+
+        with self.writer() as conn, conn as cur:
+            cur.execute(
+                """
+                INSERT INTO crawler_state
+                (cursor_state, last_created_at, partition_key)
+                VALUES
+                (?, ?, ?)
+                ON CONFLICT (partition_key)
+                DO UPDATE
+                SET
+                    cursor_state = excluded.cursor_state,
+                    last_created_at = excluded.last_created_at
+                """,
+                (cursor, last_created_at, partition_key),
+            )
+
+    # Writing pages
+
+    def write_page(self, page, skip_unchanged=False):
+        return bool(self.write_pages([page], skip_unchanged=skip_unchanged))
+
+    def write_pages(self, pages, index=True, skip_unchanged=False):
+        """
+        Inserts or replaces pages (as returned by Crawler.process_edge())
+        along with their extracts, in a single transaction.
+        Returns the pages which were written.
+
+        With index=False, the CSS index and include graph are left for
+        a later update_index() and ensure_graph() to catch up on.
+        With skip_unchanged=True, pages identical to the stored copy
+        are skipped, which is much cheaper than rewriting them.
+        """
+
+        with self.writer() as conn, conn as cur:
+            if skip_unchanged:
+                pages = [page for page in pages if self.is_page_changed(cur, page)]
+
+            cur.executemany(
+                """
+                INSERT INTO pages
+                (url, slug, title, category, created_at, wikidot_page_id, source, content_hash)
+                VALUES
+                (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url)
+                DO UPDATE
+                SET
+                    slug = excluded.slug,
+                    title = excluded.title,
+                    category = excluded.category,
+                    created_at = excluded.created_at,
+                    wikidot_page_id = excluded.wikidot_page_id,
+                    source = excluded.source,
+                    content_hash = excluded.content_hash
+                """,
+                [
+                    (
+                        *(page[column] for column in PAGE_COLUMNS),
+                        get_content_hash(page["source"]),
+                    )
+                    for page in pages
+                ],
+            )
+
+            cur.executemany(
+                "DELETE FROM extracts WHERE page_url = ?",
+                [(page["url"],) for page in pages],
+            )
+
+            cur.executemany(
+                """
+                INSERT INTO extracts
+                (page_url, extract_index, extract_type, source)
+                VALUES
+                (?, ?, ?, ?)
+                """,
+                [
+                    (page["url"], index, extract_type, extract)
+                    for page in pages
+                    for extract_type, key in EXTRACT_KEYS
+                    for index, extract in enumerate(page[key])
+                ],
+            )
+
+            if index:
+                for page in pages:
+                    cssindex.index_page(
+                        cur,
+                        page["url"],
+                        {
+                            "module_style": page["module_styles"],
+                            "inline_style": page["inline_styles"],
+                        },
+                    )
+                    includegraph.update_page(cur, page["url"], page["includes"])
+
+        return pages
+
+    @staticmethod
+    def is_page_changed(cur, page):
+        stored = cur.execute(
+            """
+            SELECT slug, title, category, created_at, wikidot_page_id, content_hash
+            FROM pages
+            WHERE url = ?
+            """,
+            (page["url"],),
+        ).fetchone()
+
+        return stored is None or tuple(stored) != (
+            page["slug"],
+            page["title"],
+            page["category"],
+            page["created_at"],
+            page["wikidot_page_id"],
+            get_content_hash(page["source"]),
+        )
+
+    # Merging databases
+
+    def merge(self, path):
+        """
+        Merges the pages and extracts from another crawl database into this one,
+        such as one partition of a distributed crawl.
+
+        Conflicts are resolved by URL, keeping whichever page was created most
+        recently (and the existing page on a tie). A page's extracts always
+        come from the same database as the page itself. Everything is copied
+        with INSERT ... SELECT over the attached database, not row by row.
+
+        The other database is migrated first, if it is out of date.
+        The indexes are not updated, callers should run the usual index updates.
+        Returns (added, replaced) page counts.
+        """
+
+        PageStore(path).close()
+        columns = ", ".join((*PAGE_COLUMNS, "content_hash"))
+
+        with self.writer() as conn:
+            conn.execute("ATTACH DATABASE ? AS merge_source", (path,))
+
+            try:
+                with conn as cur:
+                    cur.execute("DROP TABLE IF EXISTS temp.merge_winners")
+                    cur.execute(
+                        """
+                        CREATE TEMP TABLE merge_winners (
+                            url TEXT PRIMARY KEY,
+                            existing INTEGER NOT NULL
+                        )
+                        """
+                    )
+                    cur.execute(
+                        """
+                        INSERT INTO temp.merge_winners (url, existing)
+                        SELECT source_pages.url, main_pages.url IS NOT NULL
+                        FROM merge_source.pages AS source_pages
+                        LEFT JOIN main.pages AS main_pages
+                            ON main_pages.url = source_pages.url
+                        WHERE main_pages.url IS NULL
+                        OR source_pages.created_at > main_pages.created_at
+                        """
+                    )
+
+                    # The "WHERE true" avoids a parsing ambiguity with ON CONFLICT
+                    cur.execute(
+                        f"""
+                        INSERT INTO main.pages ({columns})
+                        SELECT {columns}
+                        FROM merge_source.pages
+                        WHERE true
+                        ON CONFLICT (url)
+                        DO UPDATE
+                        SET
+                            slug = excluded.slug,
+                            title = excluded.title,
+                            category = excluded.category,
+                            created_at = excluded.created_at,
+                            wikidot_page_id = excluded.wikidot_page_id,
+                            source = excluded.source,
+                            content_hash = excluded.content_hash
+                        WHERE excluded.created_at > pages.created_at
+                        """
+                    )
+
+                    cur.execute(
+                        """
+                        DELETE FROM main.extracts
+                        WHERE page_url IN (SELECT url FROM temp.merge_winners)
+                        """
+                    )
+                    cur.execute(
+                        """
+                        INSERT INTO main.extracts
+                        (page_url, extract_type, extract_index, source)
+                        SELECT page_url, extract_type, extract_index, source
+                        FROM merge_source.extracts
+                        WHERE page_url IN (SELECT url FROM temp.merge_winners)
+                        """
+                    )
+
+                    added, replaced = cur.execute(
+                        """
+                        SELECT
+                            COALESCE(SUM(NOT existing), 0),
+                            COALESCE(SUM(existing), 0)
+                        FROM temp.merge_winners
+                        """
+                    ).fetchone()
+
+                    cur.execute("DROP TABLE temp.merge_winners")
+            finally:
+                conn.execute("DETACH DATABASE merge_source")
+
+        return added, replaced
+
+    # Reading pages
+
+    def get_select_columns(self, columns):
+        """
+        Returns the SELECT list for these page columns,
+        computing content hashes in databases from before they were stored.
+        """
+
+        return ", ".join(
+            "sha1_hex(source) AS content_hash"
+            if column == "content_hash" and column not in self.page_columns
+            else column
+            for column in columns
+        )
+
+    def get_page_count(self, site=None):
+        where, params = get_sites_filter("url", [site] if site else None)
+
+        with self.reader() as conn:
+            (count,) = conn.execute(
+                f"SELECT COUNT(*) FROM pages WHERE {where}",
+                params,
+            ).fetchone()
+
+        return count
+
+    def get_page_extracts(self, url):
+        """
+        Returns a dictionary mapping each extract type
+        to the page's extracts of that type, in order.
+        """
+
+        extracts = {extract_type: [] for extract_type in EXTRACT_TYPES}
+
+        with self.reader() as conn:
+            rows = conn.execute(
+                """
+                SELECT extract_type, source FROM extracts
+                WHERE page_url = ?
+                ORDER BY extract_type, extract_index
+                """,
+                (url,),
+            )
+
+            for extract_type, source in rows:
+                extracts[extract_type].append(source)
+
+        return extracts
+
+    def iter_pages(self, sites=None, columns=PAGE_COLUMNS, order_by="slug"):
+        """
+        Yields pages from the given sites (or all sites), as rows.
+        Pass order_by=None to read in storage order, which is fastest.
+        """
+
+        where, params = get_sites_filter("url", sites)
+        order = "" if order_by is None else f"ORDER BY {order_by}"
+
+        with self.reader() as conn:
+            yield from stream(
+                conn,
+                f"SELECT {self.get_select_columns(columns)} FROM pages "
+                f"WHERE {where} {order}",
+                params,
+            )
+
+    def iter_extracts(self, sites=None, extract_types=EXTRACT_TYPES, slugs=None):
+        """
+        Yields (slug, page_url, extract_type, source) for every extract,
+        ordered by page slug, then by extract type and position.
+        If slugs is given, only the extracts of those pages are read.
+        """
+
+        where, params = get_sites_filter("pages.url", sites)
+        slugs_where, slugs_params = get_slugs_filter("pages.url", sites, slugs)
+        placeholders = ", ".join("?" for _ in extract_types)
+
+        with self.reader() as conn:
+            yield from stream(
+                conn,
+                f"""
+                SELECT pages.slug, extracts.page_url, extracts.extract_type, extracts.source
+                FROM pages
+                JOIN extracts
+                    ON extracts.page_url = pages.url
+                WHERE {where}
+                AND {slugs_where}
+                AND extracts.extract_type IN ({placeholders})
+                ORDER BY pages.slug, pages.url, extracts.extract_type, extracts.extract_index
+                """,
+                (*params, *slugs_params, *extract_types),
+            )
+
+    def iter_extract_rows(self, sites=None, extract_types=EXTRACT_TYPES):
+        """
+        Yields (page_url, extract_type, extract_index, source) for every extract,
+        in storage order, which is fastest. Rows are not sorted.
+        """
+
+        where, params = get_sites_filter("page_url", sites)
+        placeholders = ", ".join("?" for _ in extract_types)
+
+        with self.reader() as conn:
+            yield from stream(
+                conn,
+                f"""
+                SELECT page_url, extract_type, extract_index, source
+                FROM extracts
+                WHERE {where}
+                AND extract_type IN ({placeholders})
+                """,
+                (*params, *extract_types),
+            )
+
+    def iter_pages_with_extracts(self, sites=None, columns=PAGE_COLUMNS, slugs=None):
+        """
+        Yields (page, extracts) ordered by slug, where extracts maps
+        each extract type to the page's extracts of that type, in order.
+        If slugs is given, only those pages are read.
+
+        This merges two streams rather than querying extracts page by page.
+        """
+
+        if "url" not in columns:
+            columns = ("url", *columns)
+
+        where, params = get_sites_filter("url", sites)
+        slugs_where, slugs_params = get_slugs_filter("url", sites, slugs)
+
+        with self.reader() as conn:
+            pages = stream(
+                conn,
+                f"SELECT {self.get_select_columns(columns)} FROM pages "
+                f"WHERE {where} AND {slugs_where} ORDER BY slug, url",
+                (*params, *slugs_params),
+            )
+            extracts = groupby(
+                self.iter_extracts(sites, slugs=slugs),
+                key=itemgetter("page_url"),
+            )
+            group = next(extracts, None)
+
+            for page in pages:
+                page_extracts = {extract_type: [] for extract_type in EXTRACT_TYPES}
+
+                if group is not None and group[0] == page["url"]:
+                    for row in group[1]:
+                        page_extracts[row["extract_type"]].append(row["source"])
+
+                    group = next(extracts, None)
+
+                yield page, page_extracts
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+"""
+Generates a deterministic synthetic crawl database, for testing and benchmarks.
+
+The pages are written through the same PageStore and extraction code
+fetch.py uses, so every other tool can run on the result.
+The wikitext is modeled loosely on the SCP Wiki: most pages include a theme
+component, many carry lightly edited copies of a few dozen stylesheets,
+and inline styles and classes are drawn from a shared vocabulary.
+"""
+
+import os
+import random
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+from fetch import Crawler
+from store import PageStore
+
+BATCH_SIZE = 1000
+THEME_COUNT = 40
+COMPONENT_COUNT = 60
+
+WORDS = (
+    "item class containment procedures description addendum foundation site "
+    "personnel anomalous object subject researcher director incident log test "
+    "document redacted expunged level clearance entity report note access the "
+    "of and to is was in for with by on that be as are from at this which"
+).split()
+
+COLORS = (
+    "#901",
+    "#333",
+    "#fff",
+    "#000",
+    "red",
+    "black",
+    "white",
+    "darkred",
+    "#f5f5f5",
+    "rgba(0, 0, 0, 0.5)",
+)
+
+CSS_PROPERTIES = {
+    "color": COLORS,
+    "background-color": COLORS,
+    "border": ("1px solid #000", "2px dashed #901", "none", "1px solid #ccc"),
+    "font-family": ("'Courier New', monospace", "Arial, sans-serif", "serif"),
+    "font-size": ("80%", "90%", "1.2em", "14px", "small"),
+    "margin": ("0", "0 auto", "1em", "1em 0", "2rem"),
+    "padding": ("0", "0.5em", "1em", "5px 10px"),
+    "text-align": ("center", "left", "right", "justify"),
+    "width": ("100%", "50%", "300px", "auto"),
+    "display": ("none", "block", "inline-block", "flex"),
+    "position": ("relative", "absolute", "fixed"),
+    "max-width": ("100%", "60rem", "800px"),
+}
+
+CSS_SELECTORS = (
+    "#page-content",
+    "#header",
+    "#side-bar",
+    "#top-bar",
+    "#page-title",
+    ".content-panel",
+    ".footer-wikiwalk-nav",
+    ".scp-image-block",
+    "blockquote",
+    "div.blockquote",
+    ".collapsible-block-link",
+    "a.newpage",
+    "#u-author_block",
+    ".anom-bar-container",
+    "h1, h2, h3",
+    "@media (max-width: 767px)",
+)
+
+CLASSES = (
+    "blockquote",
+    "content-panel",
+    "standalone",
+    "centered",
+    "scp-image-block",
+    "block-right",
+    "block-left",
+    "footnotes-footer",
+    "anom-bar",
+    "notation",
+    "redacted",
+    "typewriter",
+    "document",
+    "modal",
+)
+
+
+class CorpusGenerator:
+    def __init__(self, seed, sites):
+        self.random = random.Random(seed)
+        self.sites = sites
+        self.themes = [self.make_stylesheet() for _ in range(THEME_COUNT)]
+        self.components = []
+        while len(self.components) < COMPONENT_COUNT:
+            component = f"component:{self.make_name()}"
+            if component not in self.components:
+                self.components.append(component)
+
+        self.component_weights = [1 / (rank + 1) for rank in range(COMPONENT_COUNT)]
+        self.theme_weights = [1 / (rank + 1) for rank in range(THEME_COUNT)]
+
+    def make_name(self):
+        return "-".join(self.random.sample(WORDS, 2))
+
+    def make_declarations(self, count):
+        properties = self.random.sample(sorted(CSS_PROPERTIES), count)
+        return [
+            (property, self.random.choice(CSS_PROPERTIES[property]))
+            for property in properties
+        ]
+
+    def make_rule(self):
+        selector = self.random.choice(CSS_SELECTORS)
+        declarations = self.make_declarations(self.random.randint(1, 5))
+        body = "\n".join(f"    {property}: {value};" for property, value in declarations)
+
+        if selector.startswith("@"):
+            inner = self.random.choice(CSS_SELECTORS[:-1])
+            return f"{selector} {{\n  {inner} {{\n{body}\n  }}\n}}"
+        else:
+            return f"{selector} {{\n{body}\n}}"
+
+    def make_stylesheet(self):
+        return [self.make_rule() for _ in range(self.random.randint(3, 12))]
+
+    def make_variant(self, theme):
+        # Lightly edit a theme, as happens when pages copy and tweak one
+        rules = list(theme)
+        edits = self.random.choice((0, 0, 1, 1, 2, 3))
+
+        for _ in range(edits):
+            action = self.random.random()
+            if action < 0.5:
+                rules[self.random.randrange(len(rules))] = self.make_rule()
+            elif action < 0.8:
+                rules.append(self.make_rule())
+            elif len(rules) > 1:
+                rules.pop(self.random.randrange(len(rules)))
+
+        return "\n\n".join(rules)
+
+    def make_paragraph(self):
+        count = int(self.random.lognormvariate(3.5, 0.8)) + 1
+        return " ".join(self.random.choice(WORDS) for _ in range(count)).capitalize() + "."
+
+    def make_include(self, site):
+        component = self.random.choices(self.components, self.component_weights)[0]
+        if self.random.random() < 0.3:
+            return f"[[include :{site}:{component}]]"
+        else:
+            return f"[[include {component}]]"
+
+    def make_inline_block(self):
+        declarations = self.make_declarations(self.random.randint(1, 3))
+        style = " ".join(f"{property}: {value};" for property, value in declarations)
+        classes = " ".join(self.random.sample(CLASSES, self.random.randint(0, 2)))
+
+        if classes:
+            attributes = f'class="{classes}" style="{style}"'
+        else:
+            attributes = f'style="{style}"'
+
+        return f"[[div {attributes}]]\n{self.make_paragraph()}\n[[/div]]"
+
+    def make_source(self, site, component=False):
+        parts = []
+
+        if component or self.random.random() < 0.6:
+            parts.append(self.make_include(site))
+
+        if component or self.random.random() < 0.3:
+            theme = self.random.choices(self.themes, self.theme_weights)[0]
+            parts.append(f"[[module CSS]]\n{self.make_variant(theme)}\n[[/module]]")
+
+        for _ in range(self.random.randint(2, 20)):
+            if self.random.random() < 0.15:
+                parts.append(self.make_inline_block())
+            else:
+                parts.append(self.make_paragraph())
+
+        return "\n\n".join(parts)
+
+    def make_edges(self, count):
+        """
+        Yields Crom-style edges, as accepted by Crawler.process_edge().
+        The components come first, so includes resolve within each site.
+        """
+
+        created_at = datetime(2008, 7, 19)
+
+        for i in range(count):
+            site = self.sites[i % len(self.sites)]
+            index = i // len(self.sites)
+
+            if index < COMPONENT_COUNT:
+                slug = self.components[index]
+                source = self.make_source(site, component=True)
+            elif self.random.random() < 0.8:
+                slug = f"scp-{index - COMPONENT_COUNT + 1:03}"
+                source = self.make_source(site)
+            else:
+                slug = f"tale-{self.make_name()}-{index}"
+                source = self.make_source(site)
+
+            created_at += timedelta(minutes=self.random.randint(1, 600))
+            category = slug.split(":", 1)[0] if ":" in slug else "_default"
+
+            yield {
+                "node": {
+                    "url": f"http://{site}.wikidot.com/{slug}",
+                    "wikidotInfo": {
+                        "title": slug.replace("-", " ").title(),
+                        "category": category,
+                        "createdAt": created_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                        "wikidotId": 1000000 + i,
+                        "source": source,
+                    },
+                },
+            }
+
+
+def write_corpus(path, edges):
+    """
+    Writes the pages without indexing them,
+    which is left to the usual index updates.
+    """
+
+    store = PageStore(path)
+    pages = []
+    last_created_at = None
+    count = 0
+
+    for edge in edges:
+        page, _ = Crawler.process_edge(edge)
+        pages.append(page)
+        last_created_at = page["created_at"]
+        count += 1
+
+        if len(pages) >= BATCH_SIZE:
+            store.write_pages(pages, index=False)
+            pages.clear()
+
+    store.write_pages(pages, index=False)
+    store.save_state("", last_created_at)
+    store.close()
+    return count
+
+
+def generate_corpus(path, pages, seed=0, sites=("scp-wiki",)):
+    if os.path.exists(path):
+        os.remove(path)
+
+    generator = CorpusGenerator(seed, list(sites))
+    return write_corpus(path, generator.make_edges(pages))
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description="Generate a synthetic crawl database")
+    argparser.add_argument(
+        "-n",
+        "--pages",
+        type=int,
+        default=1000,
+        help="How many pages to generate",
+    )
+    argparser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The random seed, the same seed always generates the same corpus",
+    )
+    argparser.add_argument(
+        "-S",
+        "--site",
+        default="scp-wiki",
+        dest="sites",
+        help="Which sites to spread the pages across (comma-separated)",
+    )
+    argparser.add_argument(
+        "path",
+        help="The SQLite file to write (replaced if it exists)",
+    )
+    args = argparser.parse_args()
+
+    print(f"Generating {args.pages} pages into {args.path}...")
+    count = generate_corpus(args.path, args.pages, args.seed, args.sites.split(","))
+    print(f"Wrote {count} pages")
@@ -0,0 +1,265 @@
+"""
+Groups near-duplicate module CSS into "theme families".
+
+Each unique [[module CSS]] block is reduced to a MinHash signature over
+shingles of its normalized tokens, then locality-sensitive hashing buckets
+signatures by band so only likely matches are ever compared.
+This is roughly linear in the number of unique blocks, unlike comparing every pair.
+
+Signatures use one-permutation hashing (one hash per shingle, split into bins)
+rather than a separate hash function per permutation, which keeps signing
+fast enough in pure Python. They are cached in the results database.
+"""
+
+import hashlib
+import re
+from array import array
+from collections import defaultdict, namedtuple
+from operator import attrgetter
+
+from cssindex import REGEX_CSS_COMMENT, get_source_hash
+
+SIGNATURE_SIZE = 128
+SHINGLE_SIZE = 5
+SIGNATURE_SCHEME = f"oph-{SIGNATURE_SIZE}-{SHINGLE_SIZE}"
+
+REGEX_CSS_TOKEN = re.compile(r"[^\s{}:;,()]+|[{}:;,()]")
+
+EMPTY_BIN = (1 << 64) - 1
+
+# The chance that a pair exactly at the similarity threshold is compared
+LSH_MIN_RECALL = 0.9
+
+THEME_SCHEMA = """
+CREATE TABLE IF NOT EXISTS css_signatures (
+    source_hash TEXT PRIMARY KEY,
+    scheme TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+"""
+
+ThemeVariant = namedtuple("ThemeVariant", ("style", "pages", "count", "similarity"))
+ThemeFamily = namedtuple("ThemeFamily", ("canonical", "variants", "count"))
+
+
+# Signatures
+
+
+def get_shingles(source):
+    tokens = REGEX_CSS_TOKEN.findall(REGEX_CSS_COMMENT.sub("", source).lower())
+    if len(tokens) < SHINGLE_SIZE:
+        return {" ".join(tokens)}
+
+    return {
+        " ".join(tokens[i : i + SHINGLE_SIZE])
+        for i in range(len(tokens) - SHINGLE_SIZE + 1)
+    }
+
+
+def get_signature(source):
+    signature = array("Q", [EMPTY_BIN]) * SIGNATURE_SIZE
+
+    for shingle in get_shingles(source):
+        digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        index = value % SIGNATURE_SIZE
+        if value < signature[index]:
+            signature[index] = value
+
+    # Densification: fill each empty bin from the next non-empty one,
+    # so that sparse (short) stylesheets still compare correctly.
+    if EMPTY_BIN in signature:
+        filled = [i for i, value in enumerate(signature) if value != EMPTY_BIN]
+        if filled:
+            for i in range(SIGNATURE_SIZE):
+                if signature[i] == EMPTY_BIN:
+                    offset = next((j for j in filled if j > i), filled[0])
+                    signature[i] = signature[offset]
+
+    return signature
+
+
+def get_similarity(first, second):
+    matches = sum(1 for x, y in zip(first, second) if x == y)
+    return matches / SIGNATURE_SIZE
+
+
+def update_signatures(conn):
+    """
+    Computes signatures for every unique module style without one,
+    and drops signatures which are stale or no longer used.
+    Returns the number of signatures computed.
+    """
+
+    with conn as cur:
+        cur.execute("DELETE FROM css_signatures WHERE scheme != ?", (SIGNATURE_SCHEME,))
+
+        existing = {
+            source_hash
+            for (source_hash,) in cur.execute("SELECT source_hash FROM css_signatures")
+        }
+        seen = set()
+        signatures = []
+
+        rows = cur.execute(
+            "SELECT DISTINCT source FROM extracts WHERE extract_type = 'module_style'"
+        )
+        for (source,) in rows:
+            source_hash = get_source_hash("module_style", source)
+            seen.add(source_hash)
+
+            if source_hash not in existing:
+                signature = get_signature(source)
+                signatures.append((source_hash, SIGNATURE_SCHEME, signature.tobytes()))
+
+        cur.executemany(
+            """
+            INSERT INTO css_signatures
+            (source_hash, scheme, signature)
+            VALUES
+            (?, ?, ?)
+            """,
+            signatures,
+        )
+
+        cur.executemany(
+            "DELETE FROM css_signatures WHERE source_hash = ?",
+            ((source_hash,) for source_hash in existing - seen),
+        )
+
+    return len(signatures)
+
+
+def load_signatures(cur, styles):
+    """
+    Returns a list of signatures, in the same order as the given styles.
+    Any styles not already in the cache are signed now.
+    """
+
+    hashes = [get_source_hash("module_style", style) for style in styles]
+    cached = {}
+
+    # Stay under SQLite's bound parameter limit
+    for i in range(0, len(hashes), 500):
+        batch = hashes[i : i + 500]
+        placeholders = ", ".join("?" for _ in batch)
+        rows = cur.execute(
+            f"""
+            SELECT source_hash, signature FROM css_signatures
+            WHERE scheme = ? AND source_hash IN ({placeholders})
+            """,
+            (SIGNATURE_SCHEME, *batch),
+        )
+
+        for source_hash, blob in rows:
+            signature = array("Q")
+            signature.frombytes(blob)
+            cached[source_hash] = signature
+
+    return [
+        cached.get(source_hash) or get_signature(style)
+        for source_hash, style in zip(hashes, styles)
+    ]
+
+
+# Clustering
+
+
+def get_collision_probability(similarity, bands, rows):
+    return 1 - (1 - similarity**rows) ** bands
+
+
+def get_band_layout(threshold):
+    """
+    Picks the number of bands and rows per band. Pairs at the requested
+    threshold become candidates with probability at least LSH_MIN_RECALL,
+    so the curve's midpoint sits below the threshold. Among those layouts,
+    the one with the most rows per band is used, to keep the number of
+    dissimilar candidates (which get_similarity() then rejects) down.
+
+    Bands needn't use up the whole signature, which allows finer layouts.
+    """
+
+    layouts = [
+        (SIGNATURE_SIZE // rows, rows)
+        for rows in range(SIGNATURE_SIZE, 0, -1)
+    ]
+
+    for bands, rows in layouts:
+        if get_collision_probability(threshold, bands, rows) >= LSH_MIN_RECALL:
+            return bands, rows
+
+    return SIGNATURE_SIZE, 1
+
+
+def find_similar_groups(signatures, threshold):
+    """
+    Groups signatures whose estimated Jaccard similarity
+    meets the threshold (transitively), returning lists of indices.
+    """
+
+    parents = list(range(len(signatures)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    bands, rows = get_band_layout(threshold)
+
+    for band in range(bands):
+        start = band * rows
+        buckets = defaultdict(list)
+
+        for i, signature in enumerate(signatures):
+            key = tuple(signature[start : start + rows])
+            buckets[key].append(i)
+
+        for members in buckets.values():
+            # Only compare against the first member of the bucket,
+            # which avoids quadratic blowup on very common themes.
+            first = members[0]
+            for other in members[1:]:
+                if find(first) == find(other):
+                    continue
+
+                similarity = get_similarity(signatures[first], signatures[other])
+                if similarity >= threshold:
+                    parents[find(other)] = find(first)
+
+    groups = defaultdict(list)
+    for i in range(len(signatures)):
+        groups[find(i)].append(i)
+
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def find_theme_families(cur, module_styles, threshold):
+    """
+    Takes the (style, pages, count) entries of the module styles report,
+    and returns the theme families found among them, most used first.
+
+    The canonical version of each family is its most used variant.
+    """
+
+    styles = [style for style, _, _ in module_styles]
+    signatures = load_signatures(cur, styles)
+    families = []
+
+    for members in find_similar_groups(signatures, threshold):
+        members.sort(key=lambda i: module_styles[i][2], reverse=True)
+        canonical = members[0]
+        canonical_signature = signatures[canonical]
+
+        variants = []
+        for i in members:
+            style, pages, count = module_styles[i]
+            similarity = get_similarity(canonical_signature, signatures[i])
+            variants.append(ThemeVariant(style, pages, count, similarity))
+
+        total = sum(variant.count for variant in variants)
+        families.append(ThemeFamily(variants[0], variants[1:], total))
+
+    families.sort(key=attrgetter("count"), reverse=True)
+    return families